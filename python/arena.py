@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+
+from array import array
+
+from parser import Node, Nodes
+
+
+NONE = -1
+
+
+class Arena(object):
+    ## A syntax tree flattened into parallel arrays, numbered in preorder
+    ## so that every subtree is a contiguous range. Node i has the type
+    ## types[i], the lexeme strings[lexemes[i]] and the source offset
+    ## offsets[i]; its children are first[i], next[first[i]], ...
+    types_of = (None,) + tuple(Nodes)
+
+    def __init__(self, lines=None):
+        self.lines = lines
+        self.types = array('B')
+        self.lexemes = array('l')
+        self.offsets = array('l')
+        self.first = array('l')
+        self.next = array('l')
+        self.last = array('l')
+        self.strings = []
+        self.string_ids = {}
+
+
+    def __len__(self):
+        return len(self.types)
+
+
+    def add(self, node_type, offset=None, lexeme=None, parent=NONE):
+        index = len(self.types)
+        if lexeme is None:
+            lexeme_id = NONE
+        else:
+            lexeme_id = self.string_ids.get(lexeme)
+            if lexeme_id is None:
+                lexeme_id = self.string_ids[lexeme] = len(self.strings)
+                self.strings.append(lexeme)
+        self.types.append(node_type.value)
+        self.lexemes.append(lexeme_id)
+        self.offsets.append(NONE if offset is None else offset)
+        self.first.append(NONE)
+        self.next.append(NONE)
+        self.last.append(NONE)
+        if parent != NONE:
+            if self.first[parent] == NONE:
+                self.first[parent] = index
+            else:
+                self.next[self.last[parent]] = index
+            self.last[parent] = index
+        return index
+
+
+    @classmethod
+    def from_tree(cls, root):
+        arena = cls(root.lines)
+        stack = [(root, NONE)]
+        while stack:
+            node, parent = stack.pop()
+            index = arena.add(node.node_type, node.offset, node.lexeme,
+                              parent)
+            stack.extend((child, index) for child in reversed(node.nodes))
+        return arena
+
+
+    def to_tree(self):
+        nodes = [Node(self.types_of[self.types[i]],
+                      None if self.offsets[i] == NONE else self.offsets[i],
+                      self.lexeme(i), (), self.lines)
+                 for i in range(len(self.types))]
+        for i, node in enumerate(nodes):
+            node.nodes = [nodes[child] for child in self.children(i)]
+        return nodes[0]
+
+
+    def root(self):
+        return ArenaNode(self, 0)
+
+
+    def children(self, index):
+        child = self.first[index]
+        while child != NONE:
+            yield child
+            child = self.next[child]
+
+
+    def lexeme(self, index):
+        lexeme_id = self.lexemes[index]
+        if lexeme_id != NONE:
+            return self.strings[lexeme_id]
+
+
+
+class ArenaNode(object):
+    ## A lightweight handle on one arena entry with the same attributes as
+    ## Node, so that CodeGenerator and the other tree walkers can run over
+    ## an arena directly.
+    __slots__ = ('arena', 'index')
+
+    def __init__(self, arena, index):
+        self.arena = arena
+        self.index = index
+
+
+    @property
+    def node_type(self):
+        return self.arena.types_of[self.arena.types[self.index]]
+
+
+    @property
+    def lexeme(self):
+        return self.arena.lexeme(self.index)
+
+
+    @property
+    def offset(self):
+        offset = self.arena.offsets[self.index]
+        if offset != NONE:
+            return offset
+
+
+    @property
+    def lines(self):
+        return self.arena.lines
+
+
+    @property
+    def nodes(self):
+        return [ArenaNode(self.arena, child)
+                for child in self.arena.children(self.index)]
+
+
+    @property
+    def line(self):
+        if self.offset is not None and self.lines is not None:
+            return self.lines.position(self.offset)[0]
+
+
+    @property
+    def column(self):
+        if self.offset is not None and self.lines is not None:
+            return self.lines.position(self.offset)[1]
+
+
+    def __str__(self):
+        return f'{self.node_type.name} {self.lexeme or ""}'
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+import glob
+import os
+import time
+
+from utils import bot_source
+
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      os.pardir, 'original')
+
+
+def corpus(root=CORPUS):
+    sources = []
+    for path in sorted(glob.glob(os.path.join(root, 'All_*Bots', '*.bot'))):
+        with open(path, 'rb') as f:
+            sources.append((os.path.basename(path), bot_source(f.read())))
+    return sources
+
+
+def best_of(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def report(name, elapsed, sources, units=None, unit_name=None):
+    size = sum(len(source) for _, source in sources)
+    line = (f'{name:<12} {elapsed*1000:9.3f} ms/pass  '
+            f'{size / elapsed / 1e6:7.2f} MB/s')
+    if units is not None:
+        line += f'  {units / elapsed / 1e3:9.1f} k{unit_name}/s'
+    print(line)
+
+
+def bench_tokenizer(sources, repeat):
+    from tokenizer import TokenStream
+
+    count = sum(len(TokenStream(source)) for _, source in sources)
+
+    def run():
+        for _, source in sources:
+            TokenStream(source)
+
+    report('tokenizer', best_of(run, repeat), sources, count, 'tokens')
+
+
+def bench_parser(sources, repeat):
+    from parser import Parser
+
+    def run():
+        for _, source in sources:
+            Parser(source).parse()
+
+    report('parser', best_of(run, repeat), sources)
+
+
+def bench_validator(sources, repeat):
+    from parser import Parser
+    from validator import validate
+
+    def parse():
+        for _, source in sources:
+            Parser(source).parse()
+
+    def run():
+        for _, source in sources:
+            validate(source)
+
+    report('parse', best_of(parse, repeat), sources)
+    report('validate', best_of(run, repeat), sources)
+
+
+def bench_compile(sources, repeat):
+    import tracemalloc
+    from code import CodeError, CodeGenerator
+    from emitter import Emitter
+    from parser import Parser
+
+    def tree():
+        for _, source in sources:
+            try:
+                CodeGenerator(Parser(source).parse()).generate()
+            except CodeError:
+                pass
+
+    def single_pass():
+        for _, source in sources:
+            try:
+                Emitter(source).generate()
+            except CodeError:
+                pass
+
+    for name, run in (('tree', tree), ('single-pass', single_pass)):
+        report(name, best_of(run, repeat), sources)
+        tracemalloc.start()
+        run()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f'{"":<12} {peak / 1024:9.1f} KiB peak')
+
+
+def bench_incremental(sources, repeat):
+    from incremental import IncrementalParser
+    from parser import Parser
+
+    ## One-character edits near the end of each source, as typed in an
+    ## editor: every parse sees a slightly different text.
+    edits = []
+    for _, source in sources:
+        at = source.rfind(';')
+        edits.append([source[:at] + ' ' * i + source[at:]
+                      for i in range(10)])
+
+    def full():
+        for versions in edits:
+            for source in versions:
+                Parser(source).parse()
+
+    parsers = [IncrementalParser(versions[0]) for versions in edits]
+    [parser.parse() for parser in parsers]
+
+    def incremental():
+        for parser, versions in zip(parsers, edits):
+            for source in versions:
+                parser.update(source)
+                parser.parse()
+
+    count = sum(len(versions) for versions in edits)
+    report('full', best_of(full, repeat), sources, count, 'parses')
+    report('incremental', best_of(incremental, repeat), sources, count,
+           'parses')
+
+
+## Milliseconds each warbots command may spend importing before it does
+## any work; quick looks at a file have to feel instant.
+STARTUP_BUDGET = {
+    'inspect': 40,
+    'tokens': 50,
+    'tree': 50,
+    'disasm': 60,
+    'compile': 80,
+}
+
+
+def import_time(lines):
+    ## Total microseconds of the top level imports in -X importtime output
+    total = 0
+    for line in lines:
+        if not line.startswith('import time:'):
+            continue
+        _, cumulative, name = line.split('|')
+        if not name[1:].startswith(' ') and cumulative.strip().isdigit():
+            total += int(cumulative)
+    return total
+
+
+def bench_startup(sources, repeat):
+    import subprocess
+    import sys
+    import tempfile
+
+    bots = sorted(glob.glob(os.path.join(CORPUS, 'All_*Bots', '*.bot')))
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'warbots.py')
+    with tempfile.NamedTemporaryFile('wt', suffix='.txt') as f:
+        f.write(sources[0][1])
+        f.flush()
+        for command, budget in STARTUP_BUDGET.items():
+            if command != 'inspect':
+                path = f.name
+            elif bots:
+                path = bots[0]
+            else:
+                continue
+            best = None
+            wall = None
+            for _ in range(max(1, min(repeat, 10))):
+                start = time.perf_counter()
+                run = subprocess.run(
+                    [sys.executable, '-X', 'importtime', script, command,
+                     path], stdout=subprocess.DEVNULL,
+                    stderr=subprocess.PIPE, universal_newlines=True)
+                elapsed = time.perf_counter() - start
+                imports = import_time(run.stderr.splitlines()) / 1000
+                if best is None or imports < best:
+                    best = imports
+                if wall is None or elapsed < wall:
+                    wall = elapsed
+            verdict = 'ok' if best <= budget else 'OVER BUDGET'
+            print(f'{command:<12} {best:9.3f} ms imports  '
+                  f'{wall*1000:9.3f} ms total  '
+                  f'(budget {budget} ms: {verdict})')
+
+
+BENCHMARKS = {
+    'tokenizer': bench_tokenizer,
+    'parser': bench_parser,
+    'validator': bench_validator,
+    'compile': bench_compile,
+    'incremental': bench_incremental,
+    'startup': bench_startup,
+}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('benchmarks', nargs='*', metavar='BENCHMARK',
+                        help=f'One of {", ".join(BENCHMARKS)} (default: all)')
+    parser.add_argument('-n', '--repeat', type=int, default=20,
+                        help='Passes over the corpus; the best one is kept')
+    parser.add_argument('--corpus', default=CORPUS,
+                        help='Directory holding the All_*Bots folders')
+    args = parser.parse_args()
+    unknown = set(args.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f'unknown benchmark: {", ".join(sorted(unknown))}')
+    sources = corpus(args.corpus)
+    print(f'{len(sources)} sources, '
+          f'{sum(len(s) for _, s in sources)} bytes')
+    for name in args.benchmarks or BENCHMARKS:
+        BENCHMARKS[name](sources, args.repeat)
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+
+import mmap
+import os
+import struct
+import tempfile
+
+from utils import (BOT_HEADER, ICON_SIZE, NAME_SIZE, OFFS_CODE_START,
+                   OFFS_ICON1, OFFS_ICON2, OFFS_IS_COMPILED)
+
+
+## Signature, name, 8 unknown bytes, energy, shield, armor, speed,
+## bullet, missiles and tactical nukes
+HEADER = struct.Struct('<8s20s8s5H??')
+## Compiled flag, 3 unknown bytes, code size in words, source size
+CODE_HEADER = struct.Struct('<?3sHH')
+## Opcodes all sit below 0x8000, so negative literals read back as such.
+WORD = struct.Struct('<h')
+
+
+class BotFileError(Exception): pass
+
+
+class BotFile(object):
+    ## A .bot save file read in place. The header and attributes are
+    ## unpacked up front; icons, code and source are views into the file,
+    ## made when asked for and copied only when turned into something
+    ## else.
+    def __init__(self, data):
+        if len(data) < OFFS_CODE_START:
+            raise BotFileError(f'Expected at least {OFFS_CODE_START} '
+                               f'bytes, got {len(data)}')
+        (signature, name, self.unknown, self.energy, self.shield,
+         self.armor, self.speed, self.bullet, self.missiles,
+         self.tactical_nukes) = HEADER.unpack_from(data)
+        if signature != BOT_HEADER:
+            raise BotFileError(f'Not a .bot file: {signature!r}')
+        self.name = name.rstrip(b'\0').decode('ascii', 'replace')
+        (self.compiled, self.unknown2, self.code_size,
+         self.source_size) = CODE_HEADER.unpack_from(data, OFFS_IS_COMPILED)
+        self.view = memoryview(data)
+        self.mapped = None
+
+
+    @classmethod
+    def open(cls, path):
+        ## Maps the file rather than reading it, so pages holding
+        ## sections nobody looks at are never read.
+        with open(path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            bot = cls(mapped)
+        except:
+            mapped.close()
+            raise
+        bot.mapped = mapped
+        return bot
+
+
+    def close(self):
+        ## Views handed out must be released before this.
+        self.view.release()
+        if self.mapped is not None:
+            self.mapped.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+    @property
+    def icons(self):
+        return (self.view[OFFS_ICON1:OFFS_ICON1 + ICON_SIZE],
+                self.view[OFFS_ICON2:OFFS_ICON2 + ICON_SIZE])
+
+
+    @property
+    def bytecode(self):
+        return self.view[OFFS_CODE_START:self.source_start]
+
+
+    @property
+    def code(self):
+        return [word for word, in WORD.iter_unpack(self.bytecode)]
+
+
+    @property
+    def source_start(self):
+        return OFFS_CODE_START + self.code_size * WORD.size
+
+
+    @property
+    def source(self):
+        ## The size counts the NUL some editors end the source with.
+        view = self.view
+        start = self.source_start
+        end = min(start + self.source_size, view.nbytes)
+        while end > start and view[end - 1] == 0:
+            end -= 1
+        return view[start:end]
+
+
+    @property
+    def text(self):
+        return str(self.source, 'ascii')
+
+
+    def replace(self, **fields):
+        ## A new save file with the given fields changed and everything
+        ## else, unknown bytes included, as in this one
+        fields.setdefault('source', self.view[
+            self.source_start:self.source_start + self.source_size])
+        if 'code' not in fields:
+            fields['code'] = self.code if self.compiled else None
+        fields.setdefault('icons', self.icons)
+        for field in ('name', 'energy', 'shield', 'armor', 'speed',
+                      'bullet', 'missiles', 'tactical_nukes', 'unknown',
+                      'unknown2'):
+            fields.setdefault(field, getattr(self, field))
+        return pack(**fields)
+
+
+def pack(name='', energy=0, shield=0, armor=0, speed=0, bullet=0,
+         missiles=False, tactical_nukes=False, icons=(b'', b''), code=None,
+         source=b'', unknown=bytes(8), unknown2=bytes(3)):
+    ## A whole save file, laid out in one buffer of its final size. No
+    ## code leaves the bot uncompiled.
+    if isinstance(name, str):
+        name = name.encode('ascii')
+    if len(name) > NAME_SIZE:
+        raise BotFileError(f'Name longer than {NAME_SIZE} bytes: {name!r}')
+    if isinstance(source, str):
+        source = source.encode('ascii')
+    words = [] if code is None else [int(word) for word in code]
+    source_start = OFFS_CODE_START + len(words) * WORD.size
+    if len(words) > 0xffff or len(source) > 0xffff:
+        raise BotFileError('Code or source too large for a save file')
+    for pos, word in enumerate(words):
+        if not -0x8000 <= word <= 0x7fff:
+            raise BotFileError(f'Word {word} at {pos} does not fit in a '
+                               f'save file')
+
+    data = bytearray(source_start + len(source))
+    HEADER.pack_into(data, 0, BOT_HEADER, name, unknown, energy, shield,
+                     armor, speed, bullet, missiles, tactical_nukes)
+    for offset, icon in zip((OFFS_ICON1, OFFS_ICON2), icons):
+        if len(icon) > ICON_SIZE:
+            raise BotFileError(f'Icon larger than {ICON_SIZE} bytes')
+        data[offset:offset + len(icon)] = icon
+    CODE_HEADER.pack_into(data, OFFS_IS_COMPILED, code is not None,
+                          unknown2, len(words), len(source))
+    struct.pack_into(f'<{len(words)}h', data, OFFS_CODE_START, *words)
+    data[source_start:] = source
+    return data
+
+
+def save(path, data):
+    ## Written aside and renamed over the file, so a reader sees either
+    ## the old save file or the new one.
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp = tempfile.mkstemp(dir=directory, suffix='.bot')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        try:
+            os.chmod(temp, os.stat(path).st_mode & 0o7777)
+        except FileNotFoundError:
+            pass
+        os.replace(temp, path)
+    except:
+        os.unlink(temp)
+        raise
+
+
+if __name__ == '__main__':
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(
+        description='Read the attributes of many .bot files')
+    parser.add_argument('files', nargs='+', metavar='FILE')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    for path in args.files:
+        try:
+            with BotFile.open(path) as bot:
+                print(f'{path}: {bot.name!r} energy {bot.energy} shield '
+                      f'{bot.shield} armor {bot.armor} speed {bot.speed} '
+                      f'bullet {bot.bullet}, {bot.code_size} words, '
+                      f'{bot.source_size} bytes of source')
+        except (OSError, ValueError, BotFileError) as e:
+            print(f'{path}: {e}')
+    print(f'{len(args.files)} files in '
+          f'{(time.perf_counter() - start) * 1000:.3f} ms')
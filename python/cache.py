@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+from code import CodeError
+from opcodes import Opcodes
+from parser import ParseError
+from tokenizer import Tokens
+
+
+DEFAULT_PATH = os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+    'warbots')
+DEFAULT_LIMIT = 32 * 1024 * 1024
+
+OPCODES = {opcode.value: opcode for opcode in Opcodes}
+
+
+class Cache(object):
+    ## Compiled code by the hash of everything it was compiled from. Each
+    ## entry is a JSON file; reading one touches it, so the least
+    ## recently used go first when the cache outgrows its limit. Safe to
+    ## share between threads.
+    def __init__(self, path=DEFAULT_PATH, limit=DEFAULT_LIMIT):
+        self.path = path
+        self.limit = limit
+        ## Guards the counters and the size
+        self.lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        ## Bytes in the cache, counted on the first store
+        self.size = None
+        os.makedirs(path, exist_ok=True)
+
+
+    @staticmethod
+    def key(source, *parts):
+        digest = hashlib.sha256()
+        digest.update(source.encode('utf-8') if isinstance(source, str)
+                      else source)
+        for part in parts:
+            digest.update(b'\0' + repr(part).encode('ascii'))
+        return digest.hexdigest()
+
+
+    def entry_path(self, key):
+        return os.path.join(self.path, key[:2], key[2:] + '.json')
+
+
+    def get(self, key):
+        ## (code, error) stored under key, or None
+        path = self.entry_path(key)
+        try:
+            with open(path, 'rt') as f:
+                entry = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            with self.lock:
+                self.misses += 1
+            return None
+        with self.lock:
+            self.hits += 1
+        code = [OPCODES.get(word, word) if word is not None and
+                word > 0x7f00 else word for word in entry['code']]
+        return code, load_error(entry['error'])
+
+
+    def put(self, key, code, error=None):
+        path = self.entry_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = json.dumps({'code': [None if word is None else int(word)
+                                    for word in code],
+                           'error': dump_error(error)},
+                          separators=(',', ':'))
+        ## Written aside and renamed, so readers never see half an entry.
+        fd, temp = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'wt') as f:
+                f.write(data)
+            ## An entry stored again replaces the old one.
+            try:
+                replaced = os.stat(path).st_size
+            except FileNotFoundError:
+                replaced = 0
+            os.replace(temp, path)
+        except:
+            os.unlink(temp)
+            raise
+        with self.lock:
+            if self.size is None:
+                self.size = sum(size for _, size, _ in self.entries())
+            else:
+                self.size += len(data) - replaced
+            if self.size > self.limit:
+                self.evict()
+
+
+    def entries(self):
+        ## (path, size, last use) of every entry
+        for directory in os.scandir(self.path):
+            if not directory.is_dir():
+                continue
+            for entry in os.scandir(directory.path):
+                if entry.name.endswith('.json'):
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    yield entry.path, stat.st_size, stat.st_mtime
+
+
+    def evict(self, limit=None):
+        ## Drops the least recently used entries down to 3/4 of the limit,
+        ## so a full cache is not scanned on every store.
+        if limit is None:
+            limit = self.limit * 3 // 4
+        with self.lock:
+            entries = sorted(self.entries(), key=lambda entry: entry[2])
+            size = sum(entry[1] for entry in entries)
+            for path, entry_size, _ in entries:
+                if size <= limit:
+                    break
+                try:
+                    os.unlink(path)
+                except OSError:
+                    continue
+                size -= entry_size
+            self.size = size
+
+
+    def clear(self):
+        self.evict(0)
+
+
+def dump_error(error):
+    if isinstance(error, ParseError):
+        return {'type': 'ParseError', 'lexeme': error.lexeme,
+                'line': error.line, 'column': error.column,
+                'expected': (None if error.expected is None
+                             else error.expected.name)}
+    elif error is not None:
+        return {'type': 'CodeError', 'message': str(error)}
+
+
+def load_error(error):
+    if error is None:
+        return None
+    elif error['type'] == 'ParseError':
+        expected = error['expected']
+        return ParseError(error['lexeme'], error['line'], error['column'],
+                          None if expected is None else Tokens[expected])
+    return CodeError(error['message'])
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Show or clear the compiled code cache')
+    parser.add_argument('--path', default=DEFAULT_PATH)
+    parser.add_argument('--clear', action='store_true',
+                        help='Remove every entry')
+    args = parser.parse_args()
+
+    cache = Cache(args.path)
+    if args.clear:
+        cache.clear()
+    entries = list(cache.entries())
+    size = sum(entry[1] for entry in entries)
+    print(f'{cache.path}: {len(entries)} entries, {size} bytes '
+          f'(limit {cache.limit})')
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+
+from code import CodeGenerator
+from parser import Node, Nodes
+
+
+class CallGraph(object):
+    ## The program starts in init, when there is one, and goes on to main.
+    ROOTS = ('init', 'main')
+
+    def __init__(self, syntax_tree):
+        self.syntax_tree = syntax_tree
+        ## Procedure name -> the names it calls, in source order
+        self.calls = {}
+        for node in syntax_tree.nodes:
+            name = node.lexeme.lower()
+            callees = self.calls.setdefault(name, [])
+            for callee in self.call_sites(node):
+                if callee not in callees:
+                    callees.append(callee)
+
+
+    def call_sites(self, node):
+        stack = list(reversed(node.nodes))
+        while stack:
+            node = stack.pop()
+            if (node.node_type == Nodes.CALL and
+                node.lexeme not in CodeGenerator.CALL_MAP):
+                yield node.lexeme.lower()
+            stack.extend(reversed(node.nodes))
+
+
+    def callees(self, name):
+        return self.calls.get(name.lower(), [])
+
+
+    def callers(self, name):
+        name = name.lower()
+        return [caller for caller, callees in self.calls.items()
+                if name in callees]
+
+
+    def roots(self):
+        return [name for name in self.ROOTS if name in self.calls]
+
+
+    def reachable(self):
+        seen = set()
+        work = self.roots()
+        while work:
+            name = work.pop()
+            if name in seen or name not in self.calls:
+                continue
+            seen.add(name)
+            work.extend(self.calls[name])
+        return seen
+
+
+    def unreachable(self):
+        reachable = self.reachable()
+        return [name for name in self.calls if name not in reachable]
+
+
+    def components(self):
+        ## Tarjan's strongly connected components, without recursion so
+        ## long call chains cannot overflow the stack. Components come
+        ## out callees first.
+        calls = self.calls
+        index = {}
+        low = {}
+        stack = []
+        on_stack = set()
+        components = []
+        for root in calls:
+            if root in index:
+                continue
+            work = [(root, iter(calls[root]))]
+            index[root] = low[root] = len(index)
+            stack.append(root)
+            on_stack.add(root)
+            while work:
+                name, callees = work[-1]
+                for callee in callees:
+                    if callee not in calls:
+                        continue
+                    if callee not in index:
+                        index[callee] = low[callee] = len(index)
+                        stack.append(callee)
+                        on_stack.add(callee)
+                        work.append((callee, iter(calls[callee])))
+                        break
+                    elif callee in on_stack:
+                        low[name] = min(low[name], index[callee])
+                else:
+                    work.pop()
+                    if work:
+                        caller = work[-1][0]
+                        low[caller] = min(low[caller], low[name])
+                    if low[name] == index[name]:
+                        component = []
+                        while True:
+                            member = stack.pop()
+                            on_stack.discard(member)
+                            component.append(member)
+                            if member == name:
+                                break
+                        components.append(component[::-1])
+        return components
+
+
+    def cycles(self):
+        ## Groups of mutually recursive procedures, and procedures
+        ## calling themselves
+        return [component for component in self.components()
+                if len(component) > 1 or
+                component[0] in self.calls[component[0]]]
+
+
+    def is_recursive(self, name):
+        name = name.lower()
+        return any(name in cycle for cycle in self.cycles())
+
+
+    def prune(self):
+        ## A new tree without the procedures the program never reaches.
+        ## Every definition of a reached name is kept, so duplicates are
+        ## still reported by the code generator.
+        root = self.syntax_tree
+        reachable = self.reachable()
+        nodes = [node for node in root.nodes
+                 if node.lexeme.lower() in reachable]
+        if len(nodes) == len(root.nodes):
+            return root
+        return Node(root.node_type, root.offset, root.lexeme, nodes,
+                    root.lines)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from parser import Parser
+    from utils import BOT_HEADER, bot_source
+
+    parser = argparse.ArgumentParser(
+        description='Show the procedure call graph of a source or .bot file')
+    parser.add_argument('file', metavar='FILE')
+    args = parser.parse_args()
+
+    with open(args.file, 'rb') as f:
+        data = f.read()
+    source = (bot_source(data) if data.startswith(BOT_HEADER)
+              else str(data, 'ascii'))
+    graph = CallGraph(Parser(source).parse())
+    for name, callees in graph.calls.items():
+        print(f'{name}: {", ".join(callees)}')
+    unreachable = graph.unreachable()
+    if unreachable:
+        print(f'Unreachable: {", ".join(unreachable)}')
+    for cycle in graph.cycles():
+        print(f'Recursive: {" -> ".join(cycle)}')
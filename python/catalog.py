@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import os
+import sqlite3
+
+from botfile import BotFile, BotFileError
+
+
+DEFAULT_PATH = os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+    'warbots-catalog.sqlite3')
+
+## Header fields kept for each file, in table order
+FIELDS = ('name', 'energy', 'shield', 'armor', 'speed', 'bullet',
+          'missiles', 'tactical_nukes', 'compiled', 'code_size',
+          'source_size')
+
+SCHEMA = f'''
+CREATE TABLE IF NOT EXISTS bots (
+    path TEXT PRIMARY KEY,
+    mtime INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    hash BLOB NOT NULL,
+    {', '.join(f'{field} {"TEXT" if field == "name" else "INTEGER"}'
+               for field in FIELDS)}
+) WITHOUT ROWID
+'''
+
+
+class Catalog(object):
+    ## The header fields of every .bot file under some directories, kept
+    ## in an SQLite file. Updating reads only the files whose size or
+    ## modification time changed; queries never open a .bot file.
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)),
+                        exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute(SCHEMA)
+
+
+    def close(self):
+        self.db.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+    def update(self, paths):
+        ## Brings the entries of the given files and directories up to
+        ## date. Returns how many were read again, dropped because the
+        ## file is gone, and left as they were, and the files that could
+        ## not be read.
+        paths = [os.path.abspath(path) for path in paths]
+        known = {row[0]: (row[1], row[2]) for row in self.db.execute(
+            'SELECT path, mtime, size FROM bots')}
+        rows = []
+        failed = []
+        seen = set()
+        for path, stat in scan(paths):
+            seen.add(path)
+            if known.get(path) == (stat.st_mtime_ns, stat.st_size):
+                continue
+            try:
+                rows.append(read_entry(path, stat))
+            except (OSError, ValueError, BotFileError) as e:
+                failed.append((path, e))
+                seen.discard(path)
+
+        ## Anything under the scanned paths not found this time is gone.
+        gone = [path for path in known if path not in seen and
+                any(path == root or path.startswith(root + os.sep)
+                    for root in paths)]
+        with self.db:
+            self.db.executemany('DELETE FROM bots WHERE path = ?',
+                                [(path,) for path in gone])
+            self.db.executemany(
+                f'INSERT OR REPLACE INTO bots VALUES '
+                f'({", ".join("?" * (4 + len(FIELDS)))})', rows)
+        return len(rows), len(gone), len(seen) - len(rows), failed
+
+
+    def query(self, name=None, cpc=None, **fields):
+        ## Entries matching every given field; name is a glob pattern and
+        ## cpc the cycles per slice the speed field stands for.
+        import attribs
+
+        clauses = []
+        values = []
+        if name is not None:
+            clauses.append('name GLOB ?')
+            values.append(name)
+        if cpc is not None:
+            speeds = [speed for speed, value in attribs.CPC_VALUES.items()
+                      if value == cpc]
+            if not speeds:
+                return []
+            fields['speed'] = speeds[0]
+        for field, value in fields.items():
+            if field not in FIELDS:
+                raise ValueError(f'Unknown field {field!r}')
+            if value is not None:
+                clauses.append(f'{field} = ?')
+                values.append(value)
+        where = f' WHERE {" AND ".join(clauses)}' if clauses else ''
+        return self.db.execute(f'SELECT * FROM bots{where} ORDER BY path',
+                               values).fetchall()
+
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM bots').fetchone()[0]
+
+
+def scan(paths):
+    ## (path, stat) of every .bot file given or under a given directory
+    for path in paths:
+        if not os.path.isdir(path):
+            try:
+                yield path, os.stat(path)
+            except OSError:
+                pass
+            continue
+        stack = [path]
+        while stack:
+            try:
+                entries = list(os.scandir(stack.pop()))
+            except OSError:
+                continue
+            for entry in entries:
+                try:
+                    if entry.is_dir():
+                        stack.append(entry.path)
+                    elif entry.name.lower().endswith('.bot'):
+                        yield entry.path, entry.stat()
+                except OSError:
+                    continue
+
+
+def read_entry(path, stat):
+    with BotFile.open(path) as bot:
+        digest = hashlib.sha256(bot.view).digest()
+        return (path, stat.st_mtime_ns, stat.st_size, digest,
+                *(getattr(bot, field) for field in FIELDS))
+
+
+def main(argv=None):
+    import argparse
+    import sys
+
+    import attribs
+
+    def choice(names):
+        return {value.lower().replace(' ', '-'): key
+                for key, value in names.items()}
+
+    levels = choice(attribs.LEVEL_NAMES)
+    strengths = choice(attribs.STRENGTH_NAMES)
+    bullets = choice(attribs.BULLET_NAMES)
+
+    parser = argparse.ArgumentParser(
+        description='Index .bot files and look them up by their attributes')
+    parser.add_argument('--catalog', default=DEFAULT_PATH)
+    parser.add_argument('-u', '--update', nargs='+', metavar='PATH',
+                        help='Files or directories to (re)index first')
+    parser.add_argument('--name', help='Glob pattern for the bot name')
+    parser.add_argument('--energy', choices=levels)
+    parser.add_argument('--shield', choices=levels)
+    parser.add_argument('--armor', choices=strengths)
+    parser.add_argument('--bullet', choices=bullets)
+    parser.add_argument('--cpc', type=int,
+                        choices=sorted(attribs.CPC_VALUES.values()))
+    for flag in ('missiles', 'tactical-nukes', 'compiled'):
+        parser.add_argument(f'--{flag}', action='store_true', default=None)
+        parser.add_argument(f'--no-{flag}', action='store_false',
+                            default=None, dest=flag.replace('-', '_'))
+    parser.add_argument('-c', '--count', action='store_true',
+                        help='Print how many match instead')
+    args = parser.parse_args(argv)
+
+    with Catalog(args.catalog) as catalog:
+        if args.update:
+            updated, removed, unchanged, failed = catalog.update(args.update)
+            for path, error in failed:
+                print(f'{path}: {error}', file=sys.stderr)
+            print(f'{updated} read, {removed} removed, {unchanged} '
+                  f'unchanged, {len(failed)} unreadable; '
+                  f'{len(catalog)} in the catalog', file=sys.stderr)
+        rows = catalog.query(
+            name=args.name, cpc=args.cpc,
+            energy=levels.get(args.energy), shield=levels.get(args.shield),
+            armor=strengths.get(args.armor),
+            bullet=bullets.get(args.bullet), missiles=args.missiles,
+            tactical_nukes=args.tactical_nukes, compiled=args.compiled)
+        if args.count:
+            print(len(rows))
+        else:
+            for row in rows:
+                print(f'{row["path"]}\t{row["name"]}')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,9 @@
 # -*- coding: utf-8 -*-
 
-import re
-
+from linker import Linker
 from opcodes import Opcodes
+from parser import Nodes
 from versions import Versions
-try:
-    from parser import Nodes
-except ImportError:
-    import os, sys
-    sys.path.append(os.path.dirname(os.getcwd()))
-    from wb.parser import Nodes
 
 
 class CodeError(Exception): pass
@@ -100,10 +94,11 @@ class CodeGenerator(object):
     def __init__(self, syntax_tree, version=Versions.V2_0_0):
         self.syntax_tree = syntax_tree
         self.version = version
-        self.symtab = {}
+        self.linker = Linker()
         self.code = []
+        self.procedures = set()
         self.statement_handlers = {
-            Nodes.CALL: self.handle_call,
+            Nodes.CALL: self.handle_statement_call,
             Nodes.IF: self.handle_if,
             Nodes.OPERATOR: self.handle_operator,
             Nodes.RETURN: self.handle_return,
@@ -112,27 +107,36 @@ class CodeGenerator(object):
  
 
     def reset(self):
-        self.symtab = {}
+        self.linker.reset()
         self.code = []
 
 
     def generate(self):
         self.reset()
+        self.procedures = {node.lexeme.lower()
+                           for node in self.syntax_tree.nodes}
         main = [node for node in self.syntax_tree.nodes
                 if node.lexeme.lower() == 'main']
         if not main: 
             raise CodeError("Unable to find 'main' procedure")
         
-        self.code = [0, 'CALL_main', Opcodes.JMP] #1
+        self.code = [0, None, Opcodes.JMP] #1
 
         init = [node for node in self.syntax_tree.nodes
                 if node.lexeme.lower() == 'init']
         if init:
             self.code[0] = 3 #2
-            self.code = [3, 'CALL_init', Opcodes.JMP] + self.code #2
+            self.code = [3, None, Opcodes.JMP] + self.code #2
+            self.linker.address(0)
+            self.linker.reference(1, 'init')
+            self.linker.address(3)
+            self.linker.reference(4, 'main')
             
             ## Optimization: there is no JMP from init to main.
             self.procedure(init[0], return_jump=False)
+        else:
+            self.linker.address(0)
+            self.linker.reference(1, 'main')
 
         self.procedure(main[0])
 
@@ -141,10 +145,10 @@ class CodeGenerator(object):
             if node.lexeme.lower() not in ('init', 'main')]
 
         ## Fill the call addresses
-        for addr in range(len(self.code)):
-            found = re.findall(r'^CALL_(.+)', str(self.code[addr]))
-            if found:
-                self.code[addr] = self.symtab[found[0]]
+        undefined = self.linker.undefined()
+        if undefined:
+            raise CodeError(f'Undefined procedure {undefined[0]}')
+        self.linker.link(self.code)
 
         ## Add the End-of-code opcode for completeness
         ## (And compatibility with lower versions.)
@@ -158,67 +162,108 @@ class CodeGenerator(object):
         if return_jump:
             self.code.append(Opcodes.JMP)
         self.assert_node(node, Nodes.PROCEDURE)
-        if node.lexeme.lower() in self.symtab:
+        if not self.linker.define(node.lexeme.lower(), address):
             raise CodeError(
                 f'Procedure {node.lexeme} defined more than once')
-        else:
-            self.symtab[node.lexeme.lower()] = address
 
 
     def statement(self, node):
-        for node_type, handler in self.statement_handlers.items():
-            res = (lambda x:x[1](node) if x[0] == node.node_type
-                   else None)((node_type, handler))
-            if res is not None:
-                break
+        handler = self.statement_handlers.get(node.node_type)
+        if handler is not None:
+            handler(node)
 
 
     def expression(self, node):
-        if node.node_type == Nodes.CALL:
-            self.handle_call(node)
-        elif node.node_type == Nodes.INTEGER:
-            self.code.append(int(node.lexeme))
-        elif node.node_type == Nodes.OPERATOR:
-            self.handle_operator(node)
-        elif node.node_type == Nodes.VAR:
-            self.code.append(self.var_opcode(node.lexeme))
- 
+        ## Keeps a stack of its own rather than recursing, so expressions
+        ## nest as deeply as the parser accepts them. An operator or call
+        ## comes back to the stack, with what it still has to emit, below
+        ## its operands.
+        stack = [(node, None)]
+        while stack:
+            node, pending = stack.pop()
+            if pending is not None:
+                if node.node_type == Nodes.CALL:
+                    self.code.extend(pending)
+                else:
+                    self.close_operator(node, pending)
+                continue
+            if node.node_type == Nodes.CALL:
+                nodes, pending = self.open_call(node)
+            elif node.node_type == Nodes.OPERATOR:
+                nodes, pending = self.open_operator(node)
+            else:
+                if node.node_type == Nodes.INTEGER:
+                    self.code.append(int(node.lexeme))
+                elif node.node_type == Nodes.VAR:
+                    self.code.append(self.var_opcode(node.lexeme))
+                continue
+            stack.append((node, pending))
+            stack.extend((child, None) for child in reversed(nodes))
+
 
     def handle_call(self, node):
         self.assert_node(node, Nodes.CALL)
-        opcode = None
+        self.expression(node)
+
+
+    def open_call(self, node):
+        ## Emits what goes before the arguments; returns the arguments to
+        ## compute and the words going after them.
+        opcode = self.CALL_MAP.get(node.lexeme)
         expected_args = 0
-        try:
-            opcode = self.CALL_MAP[node.lexeme]
-        except KeyError:
-            pass
-        finally:
-            if opcode is not None:
-                expected_args = Opcodes.nargs(opcode)
-
-            actual_args = len(node.nodes)
-            if expected_args != actual_args:
-                if Opcodes.is_special(opcode) and actual_args == 0:
-                    pass 
-                else:
-                    raise CodeError(
-                            f'Expected {expected_args} ' +
-                            f'parameters for {node.lexeme}. '+
-                            f'Instead, got {actual_args} on ' +
-                            f'{node.line},{node.column}')
-            if opcode:
-                if Opcodes.is_procedure(opcode): 
-                    self.code.append(opcode)
-                    if actual_args == 1:
-                        self.expression(node.nodes[0])
-                        self.code.append(Opcodes.ASS)
-                else:
-                    [self.expression(child) for child in node.nodes]
-                    self.code.append(opcode)
+        if opcode is not None:
+            expected_args = Opcodes.nargs(opcode)
+
+        actual_args = len(node.nodes)
+        if expected_args != actual_args:
+            if Opcodes.is_special(opcode) and actual_args == 0:
+                pass 
+            else:
+                raise CodeError(
+                        f'Expected {expected_args} ' +
+                        f'parameters for {node.lexeme}. '+
+                        f'Instead, got {actual_args} on ' +
+                        f'{node.line},{node.column}')
+        if opcode:
+            if Opcodes.is_procedure(opcode): 
+                self.code.append(opcode)
+                if actual_args == 1:
+                    return node.nodes[:1], [Opcodes.ASS]
             else:
-                self.code.append(self.address() + 3) #Return address
-                self.code.append(f'CALL_{node.lexeme.lower()}')
-                self.code.append(Opcodes.JMP)
+                return node.nodes, [opcode]
+        else:
+            self.linker.address(self.address())
+            self.code.append(self.address() + 3) #Return address
+            self.linker.reference(self.address(), node.lexeme.lower())
+            self.code.append(None)
+            self.code.append(Opcodes.JMP)
+        return (), []
+
+
+    def handle_statement_call(self, node):
+        ## 'sleep' is a builtin unless the program defines its own.
+        if node.lexeme == 'sleep' and 'sleep' not in self.procedures:
+            self.handle_sleep(node)
+        else:
+            self.handle_call(node)
+
+
+    def handle_sleep(self, node):
+        actual_args = len(node.nodes)
+        if actual_args > 1:
+            raise CodeError(
+                    f'Expected 1 parameters for {node.lexeme}. ' +
+                    f'Instead, got {actual_args} on ' +
+                    f'{node.line},{node.column}')
+        ## Gives up the rest of the tick, or the given number of cycles;
+        ## versions without SLEEP just keep running.
+        if self.version.value < Versions.V2_1_0.value:
+            return
+        if node.nodes:
+            self.expression(node.nodes[0])
+        else:
+            self.code.append(0)
+        self.code.append(Opcodes.SLEEP)
 
 
     def handle_if(self, root):
@@ -229,6 +274,7 @@ class CodeGenerator(object):
             assert(len(root.nodes) < 3)
             self.expression(cond)
             end_address_pos = self.address()
+            self.linker.address(end_address_pos)
             self.code.append(None)
             self.code.append(Opcodes.JIZ)
             [self.statement(node) for node in body.nodes]
@@ -242,6 +288,7 @@ class CodeGenerator(object):
         self.expression(cond)
         else_address_pos = self.address()
         end_address_pos = set([else_address_pos])
+        self.linker.address(else_address_pos)
         self.code.append(None)
         self.code.append(Opcodes.JIZ)
         [self.statement(node) for node in body.nodes]
@@ -250,6 +297,7 @@ class CodeGenerator(object):
             self.code[else_address_pos] = self.address() + 2
             end_address_pos.remove(else_address_pos)
             end_address_pos.add(self.address())
+            self.linker.address(self.address())
             self.code.append(None)
             self.code.append(Opcodes.JMP) 
             if node.node_type == Nodes.IF:
@@ -266,20 +314,34 @@ class CodeGenerator(object):
 
     def handle_operator(self, node):
         self.assert_node(node, Nodes.OPERATOR)
-        operator = node.lexeme
+        self.expression(node)
+
+
+    def open_operator(self, node):
+        ## Returns the operands to compute and where the code computing
+        ## them starts.
         try:
-            opcode = self.OPERATOR_MAP[operator]
+            self.OPERATOR_MAP[node.lexeme]
         except KeyError:
             raise CodeError(
-                    f'Unknown operator {operator} ' +
+                    f'Unknown operator {node.lexeme} ' +
                     f'on {node.line},{node.column}')
-        last_len = self.address()
-        self.expression(node.nodes[0])
-        
-        if operator not in ('~', '!'):
-            self.expression(node.nodes[1])
-        elif (self.address() - last_len == 1 and
-              node.nodes[0].node_type == Nodes.INTEGER):
+        if node.lexeme in ('~', '!'):
+            return node.nodes[:1], self.address()
+        return node.nodes[:2], self.address()
+
+
+    def close_operator(self, node, last_len):
+        operator = node.lexeme
+        opcode = self.OPERATOR_MAP[operator]
+        if operator == '=':
+            self.code.append(opcode)
+            if self.version.value >= Versions.V2_1_0.value:
+                self.step(self.code, last_len)
+            return
+
+        if (operator in ('~', '!') and self.address() - last_len == 1 and
+            node.nodes[0].node_type == Nodes.INTEGER):
             ## Unary operation optimization for integer operand
             self.code[-1] = (-self.code[-1] if operator == '~' else
                              int(not self.code[-1]))
@@ -294,15 +356,45 @@ class CodeGenerator(object):
 
     def handle_while(self, node):
         self.assert_node(node, Nodes.WHILE)
-        self.code.append(self.address())
+        start_address = self.address()
         self.expression(node.nodes[0])
         end_address_pos = self.address()
+        self.linker.address(end_address_pos)
         self.code.append(None)
         self.code.append(Opcodes.JIZ)
         [self.statement(child) for child in node.nodes[1].nodes]
+        self.linker.address(self.address())
+        self.code.append(start_address)
+        self.code.append(Opcodes.JMP)
         self.code[end_address_pos] = self.address()
 
 
+    @staticmethod
+    def step(code, start):
+        ## 'x = x + 1' and 'x = x - 1', as the assignment starting at
+        ## start, become 'x INC' and 'x DEC'.
+        if len(code) - start != 5:
+            return False
+        var, left, right, opcode, _ = code[start:]
+        if left == var:
+            value = right
+        elif right == var and opcode == Opcodes.ADD:
+            value = left
+        else:
+            return False
+        if opcode == Opcodes.SUB:
+            value = -value
+        elif opcode != Opcodes.ADD:
+            return False
+        if value == 1:
+            code[start + 1:] = [Opcodes.INC]
+        elif value == -1:
+            code[start + 1:] = [Opcodes.DEC]
+        else:
+            return False
+        return True
+
+
     def var_opcode(self, lexeme):
         return Opcodes.A + (ord(lexeme.lower()) - ord('a'))
 
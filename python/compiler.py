@@ -1,60 +1,300 @@
 # -*- coding: utf-8 -*-
 
-import re
+import os
+import sys
+import time
 
-from code import CodeGenerator
-from opcodes import Opcodes
-from version import Versions
-try:
-    from parser import Parser
-except ImportError:
-    import os, sys
-    sys.path.append(os.path.dirname(os.getcwd()))
-    from wb.parser import Parser
+from code import CodeError, CodeGenerator
+from parser import ParseError, Parser
+from utils import BOT_HEADER, bot_source
+from versions import Versions
+
+## The incremental parser, the single pass emitter, the optimizers and
+## the batch machinery are imported where used, so a plain compile
+## starts fast.
+
+
+## Part of the key of cached code: bump it whenever the code generated
+## for a given source changes.
+COMPILER_VERSION = '2.1'
 
 
 class CompileError(Exception): pass
 
 
 class Compiler(object):
-    def __init__(self, source):
-        self.parser = Parser(source)
+    def __init__(self, source, incremental=False, single_pass=False,
+                 optimize=False, speed=False, cache=None):
+        self.incremental = incremental
+        self.optimize = optimize
+        ## Whether optimizing favors fewer executed words over code size
+        self.speed = speed
+        ## Single pass compiles emit code while parsing, without a tree
+        ## to optimize.
+        self.single_pass = single_pass and not (incremental or optimize)
+        self.source = source
+        ## A cache.Cache; a hit skips tokenizing, parsing and generating,
+        ## so a plain parser is only made when needed.
+        self.cache = cache
+        self.parser = None
+        if incremental:
+            from incremental import IncrementalParser
+            self.parser = IncrementalParser(source)
+        elif not (self.single_pass or cache is not None):
+            self.parser = Parser(source)
         self.code = []
+
+
+    def update(self, source):
+        self.source = source
+        if self.incremental:
+            self.parser.update(source)
+        elif not (self.single_pass or self.cache is not None):
+            self.parser = Parser(source)
+        else:
+            self.parser = None
  
 
     def reset(self):
-        self.parser.reset()
+        if self.parser is not None:
+            self.parser.reset()
         self.code = []
 
 
     def compile(self, version=Versions.V2_0_0):
         self.reset()
-        codegen = CodeGenerator(self.parser.parse(), version=version)
+        if self.cache is None:
+            return self.generate(version)
+        key = self.cache.key(self.source, version.value, self.optimize,
+                             self.speed, COMPILER_VERSION)
+        entry = self.cache.get(key)
+        if entry is not None:
+            self.code, error = entry
+            if error is not None:
+                raise error
+            return self.code
+        try:
+            self.generate(version)
+        except (CodeError, ParseError) as e:
+            self.cache.put(key, self.code, e)
+            raise
+        self.cache.put(key, self.code)
+        return self.code
+
+
+    def generate(self, version):
+        if self.single_pass:
+            from emitter import Emitter
+            codegen = Emitter(self.source, version=version)
+        else:
+            if self.parser is None:
+                self.parser = Parser(self.source)
+            tree = self.parser.parse()
+            if self.optimize:
+                from callgraph import CallGraph
+                from hoister import Hoister
+                from inliner import Inliner
+                from optimizer import Optimizer
+                tree = CallGraph(tree).prune()
+                tree = Inliner(tree, self.speed).inline()
+                tree = CallGraph(tree).prune()
+                tree = Optimizer(tree).optimize()
+                tree = Hoister(tree, self.speed).hoist()
+            codegen = CodeGenerator(tree, version=version)
         try:
             self.code = codegen.generate()
         except:
             self.code = codegen.code
             raise
+        if self.optimize:
+            from peephole import Peephole
+            self.code = Peephole(self.code,
+                                 codegen.linker.addresses).optimize()
+        return self.code
+
+
+def read_source(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    return (bot_source(data) if data.startswith(BOT_HEADER)
+            else str(data, 'ascii'))
+
+
+## Caches by path, one per process: a pool worker keeps its own across
+## the chunks it compiles, so the directory is sized once per worker.
+CACHES = {}
+
+
+def worker_cache(path):
+    cache = CACHES.get(path)
+    if cache is None:
+        from cache import Cache
+        cache = CACHES[path] = Cache(path)
+    return cache
+
+
+def compile_files(paths, options):
+    ## Batch work for one pool task: a result per file, in order
+    cache = options.get('cache')
+    if cache is not None:
+        cache = worker_cache(cache)
+    from botfile import BotFile, save
+    version = Versions[options.get('version', 'V2_0_0')]
+    rewrite = options.get('rewrite')
+    results = []
+    for path in paths:
+        start = time.perf_counter()
+        result = {'path': path, 'words': None, 'error': None}
+        if rewrite:
+            result['rewritten'] = False
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            bot = BotFile(data) if data.startswith(BOT_HEADER) else None
+            compiler = Compiler(bot.text if bot else str(data, 'ascii'),
+                                single_pass=options.get('single_pass'),
+                                optimize=options.get('optimize'),
+                                speed=options.get('speed'), cache=cache)
+            code = compiler.compile(version)
+            result['words'] = len(code)
+            ## Only save files whose stored code differs are written.
+            if (rewrite and bot is not None and
+                (not bot.compiled or
+                 bot.code != [int(word) for word in code])):
+                save(path, bot.replace(code=code))
+                result['rewritten'] = True
+        except Exception as e:
+            ## Whatever goes wrong with one file is that file's failure;
+            ## the rest of the batch goes on.
+            result['error'] = f'{type(e).__name__}: {e}'
+        result['seconds'] = round(time.perf_counter() - start, 6)
+        results.append(result)
+    return results
+
+
+def expand(patterns):
+    ## Files named, matched by globs or found under directories, where
+    ## .bot files are taken
+    import glob
+    paths = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            paths.update(glob.glob(os.path.join(pattern, '**', '*.bot'),
+                                   recursive=True))
+        elif os.path.exists(pattern):
+            paths.add(pattern)
         else:
-            return self.code
+            paths.update(path for path in glob.glob(pattern, recursive=True)
+                         if os.path.isfile(path))
+    return sorted(paths)
 
 
-if __name__ == '__main__':
-    import sys
+def batch(paths, options, jobs=None, chunk=32, out=sys.stdout):
+    ## Streams a JSON line per file as results come in, then a summary
+    ## that does not depend on the order they came in.
+    import json
+    chunks = [paths[i:i + chunk] for i in range(0, len(paths), chunk)]
+    summary = {'files': len(paths), 'compiled': 0, 'failed': 0,
+               'words': 0, 'errors': {}}
+    if options.get('rewrite'):
+        summary['rewritten'] = 0
+
+    def report(results):
+        for result in results:
+            out.write(json.dumps(result) + '\n')
+            if result['error'] is None:
+                summary['compiled'] += 1
+                summary['words'] += result['words']
+                if result.get('rewritten'):
+                    summary['rewritten'] += 1
+            else:
+                summary['failed'] += 1
+                kind = result['error'].split(':', 1)[0]
+                summary['errors'][kind] = summary['errors'].get(kind, 0) + 1
+        out.flush()
+
+    if jobs == 1 or len(chunks) <= 1:
+        for paths in chunks:
+            report(compile_files(paths, options))
+    else:
+        from concurrent.futures import ProcessPoolExecutor, as_completed
+        with ProcessPoolExecutor(jobs) as executor:
+            futures = {executor.submit(compile_files, paths, options): paths
+                       for paths in chunks}
+            for future in as_completed(futures):
+                try:
+                    results = future.result()
+                except Exception as e:
+                    ## A worker that died fails every file of its chunk.
+                    error = f'{type(e).__name__}: {e}'
+                    results = [{'path': path, 'words': None, 'error': error}
+                               for path in futures[future]]
+                report(results)
+    summary['errors'] = dict(sorted(summary['errors'].items()))
+    out.write(json.dumps({'summary': summary}) + '\n')
+    return summary
+
+
+def main(argv=None):
+    import argparse
     from traceback import print_exc
     from utils import prettify_code
-    
+
+    parser = argparse.ArgumentParser(
+        description='Compile a source or .bot file and show its code, or '
+                    'compile many and report each as a JSON line')
+    parser.add_argument('paths', nargs='+', metavar='PATH',
+                        help='Files, directories of .bot files or globs')
+    parser.add_argument('-b', '--batch', action='store_true',
+                        help='Report even a single file as JSON lines')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='Worker processes (default: one per CPU)')
+    parser.add_argument('-O', '--optimize', action='store_true')
+    parser.add_argument('--speed', action='store_true',
+                        help='Optimize for fewer executed words')
+    parser.add_argument('--single-pass', action='store_true')
+    parser.add_argument('--target', choices=list(Versions.__members__),
+                        default='V2_0_0')
+    parser.add_argument('--cache', metavar='DIR', nargs='?', const=True,
+                        help='Use the compiled code cache')
+    parser.add_argument('--rewrite', action='store_true',
+                        help='Store the code in each .bot file whose code '
+                             'differs, in batch')
+    args = parser.parse_args(argv)
+
+    cache = args.cache
+    if cache is not None:
+        from cache import DEFAULT_PATH, Cache
+        if cache is True:
+            cache = DEFAULT_PATH
+    options = {'single_pass': args.single_pass, 'optimize': args.optimize,
+               'speed': args.speed, 'version': args.target, 'cache': cache,
+               'rewrite': args.rewrite}
+
+    paths = args.paths
+    missing = [path for path in paths if not os.path.exists(path) and
+               not any(char in path for char in '*?[')]
+    if missing:
+        parser.error(f'no such file: {", ".join(missing)}')
+    if (args.batch or args.rewrite or len(paths) > 1 or
+        os.path.isdir(paths[0]) or not os.path.exists(paths[0])):
+        files = expand(paths)
+        if not files:
+            parser.error(f'nothing to compile in {", ".join(paths)}')
+        summary = batch(files, options, args.jobs)
+        return 1 if summary['failed'] else 0
+
+    c = Compiler(read_source(paths[0]), single_pass=args.single_pass,
+                 optimize=args.optimize, speed=args.speed,
+                 cache=cache and Cache(cache))
     try:
-        with open(sys.argv[1], 'rt') as f:
-            scode = f.read()
-            c = Compiler(scode)
-            try:
-                c.compile()
-            except:
-                print_exc()
-                print('Incomplete code output:')
-            finally:
-                print(prettify_code(c.code))
+        c.compile(Versions[args.target])
     except:
         print_exc()
+        print('Incomplete code output:')
+    finally:
+        print(prettify_code(c.code))
 
+
+if __name__ == '__main__':
+    sys.exit(main())
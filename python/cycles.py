@@ -0,0 +1,388 @@
+# -*- coding: utf-8 -*-
+
+import math
+
+from opcodes import Opcodes
+
+
+## Words reading the world around the bot
+SENSORS = frozenset((
+    Opcodes.COL,
+    Opcodes.DMG,
+    Opcodes.EGY,
+    Opcodes.RDR,
+    Opcodes.RNGE,
+    Opcodes.XPOS,
+    Opcodes.YPOS,
+))
+
+## Stands for costs no bound is known for: recursion, and loops that
+## never read a sensor.
+UNBOUNDED = math.inf
+
+
+class Loop(object):
+    __slots__ = ('start', 'end', 'cost', 'senses')
+
+    def __init__(self, start, end):
+        ## The words from the condition to the JMP back to it
+        self.start = start
+        self.end = end
+        ## Worst single iteration, inner loops taken once
+        self.cost = 0
+        ## Whether every iteration reads a sensor
+        self.senses = True
+
+
+class Procedure(object):
+    __slots__ = ('name', 'start', 'end', 'blocks', 'loops', 'calls',
+                 'cost', 'head', 'through', 'tail', 'inner')
+
+    def __init__(self, name, start, end):
+        self.name = name
+        self.start = start
+        self.end = end
+        ## (start, end) word ranges of the basic blocks
+        self.blocks = []
+        self.loops = []
+        ## Position of each calling JMP -> procedure called
+        self.calls = {}
+        ## Worst pass from entry to return, each loop taken once
+        self.cost = 0
+        ## Longest runs without reading a sensor: from the entry to the
+        ## first read, through the whole procedure, from the last read to
+        ## the return, and between two reads. None when there is no such
+        ## run.
+        self.head = None
+        self.through = None
+        self.tail = None
+        self.inner = None
+
+
+    @property
+    def size(self):
+        return self.end - self.start
+
+
+class CycleAnalyzer(object):
+    ## Every word takes one cycle. Works on code as linked by the code
+    ## generators, before peephole optimization moves things around.
+    def __init__(self, code, linker):
+        self.code = code
+        self.linker = linker
+
+
+    def analyze(self):
+        code = self.code
+        linker = self.linker
+        self.addresses = set(linker.addresses)
+        starts = sorted((address, name)
+                        for name, address in linker.symbols.items())
+        ## Code ends with EOC.
+        ends = [address for address, _ in starts[1:]] + [len(code) - 1]
+        self.procedures = {name: Procedure(name, start, end)
+                           for (start, name), end in zip(starts, ends)}
+        self.owner = {}
+        for proc in self.procedures.values():
+            for pos in range(proc.start, proc.end):
+                self.owner[pos] = proc
+        for pos, name in linker.relocations:
+            proc = self.owner.get(pos)
+            if proc is not None:
+                proc.calls[pos + 1] = self.procedures[name]
+
+        for proc in self.procedures.values():
+            self.blocks(proc)
+
+        ## Callees first; what is left calls itself, one way or another.
+        done = set()
+        pending = list(self.procedures.values())
+        while pending:
+            ready = [proc for proc in pending
+                     if all(callee in done
+                            for callee in proc.calls.values())]
+            if not ready:
+                for proc in pending:
+                    proc.cost = proc.inner = UNBOUNDED
+                    proc.head = proc.through = proc.tail = UNBOUNDED
+                    self.loops(proc)
+                break
+            for proc in ready:
+                self.loops(proc)
+                proc.cost = self.longest(proc, proc.start, proc.end)[0]
+                self.gaps(proc)
+                done.add(proc)
+            pending = [proc for proc in pending if proc not in done]
+        return sorted(self.procedures.values(), key=lambda proc: proc.start)
+
+
+    def successors(self, pos):
+        ## Where the word at pos goes next, and whether it may leave the
+        ## procedure: by returning, or by init running into main.
+        code = self.code
+        proc = self.owner[pos]
+        word = code[pos]
+        if word == Opcodes.JIZ:
+            targets = [code[pos - 1], pos + 1]
+        elif word == Opcodes.JMP:
+            if pos in proc.calls:
+                targets = [pos + 1]
+            elif pos - 1 in self.addresses:
+                targets = [code[pos - 1]]
+            else:
+                return [], True
+        elif word == Opcodes.EOC:
+            return [], True
+        else:
+            targets = [pos + 1]
+        inside = [target for target in targets
+                  if proc.start <= target < proc.end]
+        return inside, len(inside) < len(targets)
+
+
+    def weight(self, proc, pos):
+        callee = proc.calls.get(pos)
+        return 1 if callee is None else 1 + callee.cost
+
+
+    def blocks(self, proc):
+        leaders = {proc.start}
+        for pos in range(proc.start, proc.end):
+            if self.code[pos] in (Opcodes.JMP, Opcodes.JIZ):
+                leaders.add(pos + 1)
+                leaders.update(self.successors(pos)[0])
+        leaders = sorted(leader for leader in leaders if leader < proc.end)
+        proc.blocks = list(zip(leaders, leaders[1:] + [proc.end]))
+
+
+    def longest(self, proc, start, end, stop=None):
+        ## Costliest path from each word in [start, end) to stop, or out
+        ## of the procedure. Loops are taken once: the JMP back to the
+        ## condition goes on past the loop instead.
+        cost = [-UNBOUNDED] * (end - start)
+        for pos in range(end - 1, start - 1, -1):
+            targets, leaves = self.successors(pos)
+            best = (0 if pos == stop or stop is None and leaves
+                    else -UNBOUNDED)
+            if pos != stop:
+                for target in targets:
+                    if target <= pos:
+                        target = pos + 1
+                    if target < end:
+                        best = max(best, cost[target - start])
+            cost[pos - start] = best + self.weight(proc, pos)
+        return cost
+
+
+    def loops(self, proc):
+        code = self.code
+        proc.loops = []
+        for pos in range(proc.start, proc.end):
+            if code[pos] != Opcodes.JMP or pos in proc.calls:
+                continue
+            targets, _ = self.successors(pos)
+            if targets and targets[0] <= pos:
+                loop = Loop(targets[0], pos)
+                if proc.cost is UNBOUNDED:
+                    loop.cost = UNBOUNDED
+                else:
+                    loop.cost = self.longest(proc, loop.start, pos + 1,
+                                             pos)[0]
+                loop.senses = not self.free(proc, loop.start, pos)
+                proc.loops.append(loop)
+
+
+    def cuts(self, proc, pos):
+        ## Whether no run goes past the word without reading a sensor
+        callee = proc.calls.get(pos)
+        if callee is not None:
+            return callee.through is None
+        return self.code[pos] in SENSORS
+
+
+    def free(self, proc, start, stop):
+        ## Whether stop can be reached from start without a sensor read
+        seen = set()
+        work = [start]
+        while work:
+            pos = work.pop()
+            if pos in seen or not start <= pos <= stop:
+                continue
+            seen.add(pos)
+            if self.cuts(proc, pos):
+                continue
+            if pos == stop:
+                return True
+            work.extend(self.successors(pos)[0])
+        return False
+
+
+    def gaps(self, proc):
+        ## Longest runs between sensor reads. Runs start at the entry or
+        ## after a read and end at a read or the return; a run that can
+        ## go around forever makes the gap unbounded.
+        code = self.code
+        start = proc.start
+
+        reached = set()
+        work = [start]
+        while work:
+            pos = work.pop()
+            if pos not in reached:
+                reached.add(pos)
+                work.extend(self.successors(pos)[0])
+
+        ## Order the words runs go through, callers of runs first.
+        edges = {}
+        incoming = dict.fromkeys(reached, 0)
+        for pos in reached:
+            edges[pos] = [] if self.cuts(proc, pos) else \
+                self.successors(pos)[0]
+            for target in edges[pos]:
+                incoming[target] += 1
+        order = [pos for pos in reached if not incoming[pos]]
+        for pos in order:
+            for target in edges[pos]:
+                incoming[target] -= 1
+                if not incoming[target]:
+                    order.append(target)
+        if len(order) < len(reached):
+            proc.head = proc.through = proc.tail = proc.inner = UNBOUNDED
+            return
+
+        inner = None
+        for seeds, ends, exits in (({start: 0}, 'head', 'through'),
+                                   (self.restarts(proc, reached),
+                                    'inner', 'tail')):
+            value = dict(seeds)
+            found = {ends: None, exits: None}
+            for pos in order:
+                if pos not in value:
+                    continue
+                run = value[pos]
+                callee = proc.calls.get(pos)
+                if callee is not None:
+                    if callee.head is not None:
+                        found[ends] = max_of(found[ends],
+                                             run + 1 + callee.head)
+                    if callee.inner is not None:
+                        inner = max_of(inner, callee.inner)
+                    if callee.through is None:
+                        continue
+                    run += 1 + callee.through
+                elif code[pos] in SENSORS:
+                    found[ends] = max_of(found[ends], run + 1)
+                    continue
+                else:
+                    run += 1
+                targets, leaves = self.successors(pos)
+                if leaves:
+                    found[exits] = max_of(found[exits], run)
+                for target in targets:
+                    value[target] = max(value.get(target, 0), run)
+            for key, run in found.items():
+                setattr(proc, key, run)
+        proc.inner = max_of(proc.inner, inner)
+
+
+    def restarts(self, proc, reached):
+        ## Where runs pick up after a read, and how long they already are
+        seeds = {}
+        for pos in reached:
+            callee = proc.calls.get(pos)
+            if callee is not None:
+                if callee.tail is None:
+                    continue
+                run = callee.tail
+            elif self.code[pos] in SENSORS:
+                run = 0
+            else:
+                continue
+            for target in self.successors(pos)[0]:
+                seeds[target] = max(seeds.get(target, 0), run)
+        return seeds
+
+
+    def worst_gap(self):
+        ## main runs again and again: a run may go from its last read,
+        ## through the entry stub, to its first read.
+        procs = self.procedures
+        main = procs.get('main')
+        gap = None
+        for proc in procs.values():
+            gap = max_of(gap, proc.inner)
+        if main is None:
+            return gap
+        if main.through is not None:
+            return UNBOUNDED
+        init = procs.get('init')
+        for tail in (main.tail, init and init.tail):
+            if tail is not None and main.head is not None:
+                gap = max_of(gap, tail + 3 + main.head)
+        return gap
+
+
+def max_of(a, b):
+    return b if a is None else a if b is None else max(a, b)
+
+
+def cycles(cost):
+    return 'unbounded' if cost is UNBOUNDED else f'{cost}'
+
+
+if __name__ == '__main__':
+    import argparse
+    import struct
+    import sys
+
+    import attribs
+    from code import CodeError, CodeGenerator
+    from parser import ParseError, Parser
+    from utils import BOT_HEADER, OFFS_SPEED, bot_source
+
+    parser = argparse.ArgumentParser(
+        description='Report the cycles taken by the code of a bot')
+    parser.add_argument('file', metavar='FILE')
+    parser.add_argument('--cpc', type=int,
+                        choices=sorted(attribs.CPC_VALUES.values()),
+                        help='Cycles per slice; .bot files give their own')
+    parser.add_argument('-b', '--blocks', action='store_true',
+                        help='List the basic blocks too')
+    args = parser.parse_args()
+
+    with open(args.file, 'rb') as f:
+        data = f.read()
+    cpc = args.cpc
+    if data.startswith(BOT_HEADER):
+        source = bot_source(data)
+        if cpc is None:
+            cpc = attribs.CPC_VALUES[struct.unpack_from('<H', data,
+                                                        OFFS_SPEED)[0]]
+    else:
+        source = str(data, 'ascii')
+    if cpc is None:
+        cpc = attribs.CPC_VALUES[attribs.CPC_25]
+
+    try:
+        codegen = CodeGenerator(Parser(source).parse())
+        code = codegen.generate()
+    except (ParseError, CodeError) as e:
+        sys.exit(f'{args.file}: {e}')
+    analyzer = CycleAnalyzer(code, codegen.linker)
+    for proc in analyzer.analyze():
+        print(f'{proc.name}: {proc.size} words at {proc.start}, '
+              f'{cycles(proc.cost)} cycles worst pass')
+        if args.blocks:
+            for start, end in proc.blocks:
+                print(f'  block {start}-{end - 1}: {end - start} words')
+        for loop in proc.loops:
+            notes = []
+            if loop.cost > cpc:
+                notes.append(f'over one {cpc} cycle slice')
+            if not loop.senses:
+                notes.append('no sensor read')
+            notes = f' ({", ".join(notes)})' if notes else ''
+            print(f'  loop {loop.start}-{loop.end}: '
+                  f'{cycles(loop.cost)} cycles per iteration{notes}')
+    print(f'Worst case between sensor reads: '
+          f'{cycles(analyzer.worst_gap())} cycles')
@@ -0,0 +1,445 @@
+# -*- coding: utf-8 -*-
+
+from code import CodeError, CodeGenerator
+from linker import Linker
+from opcodes import Opcodes
+from parser import BINARY, COMPARISON, LOGICAL, UNARY, Parser
+from tokenizer import TokenStream, Tokens
+from versions import Versions
+
+
+## What the operand stack remembers about each subexpression: the
+## generator folds unary operators on bare literals and grafts '&' onto
+## the right operand of a preceding '|'.
+OTHER, LITERAL, OR = range(3)
+
+OPERATORS = {token: (BINARY[token], CodeGenerator.OPERATOR_MAP[lexeme])
+             for lexeme, token in TokenStream.reserved.items()
+             if token in BINARY}
+
+
+class Procedure(object):
+    __slots__ = ('name', 'offset', 'code', 'local', 'calls', 'error',
+                 'error_offset')
+
+    def __init__(self, name, offset):
+        self.name = name
+        self.offset = offset
+        self.code = []
+        ## Positions holding addresses relative to the procedure start
+        self.local = []
+        ## (position, procedure name) pairs to fill in at link time
+        self.calls = []
+        self.error = None
+        self.error_offset = None
+
+
+class Emitter(Parser):
+    def __init__(self, source, version=Versions.V2_0_0, start=0, end=None):
+        self.linker = Linker()
+        super().__init__(source, start, end)
+        self.version = version
+
+
+    def reset(self):
+        super().reset()
+        self.procedures = []
+        self.proc = None
+        self.code = []
+
+
+    def generate(self):
+        self.reset()
+        self.user_sleep = self.defines('sleep')
+        self.token()
+        while not self.token_is(None):
+            self.procedure()
+        return self.link()
+
+
+    def link(self):
+        procedures = {}
+        for proc in self.procedures:
+            procedures.setdefault(proc.name.lower(), proc)
+        main = procedures.get('main')
+        if main is None:
+            raise CodeError("Unable to find 'main' procedure")
+
+        linker = self.linker
+        linker.reset()
+        self.code = code = [0, None, Opcodes.JMP]
+        order = [main]
+        init = procedures.get('init')
+        if init is not None:
+            self.code = code = [3, None, Opcodes.JMP, 3, None, Opcodes.JMP]
+            linker.address(0)
+            linker.reference(1, 'init')
+            linker.address(3)
+            linker.reference(4, 'main')
+            order.insert(0, init)
+        else:
+            linker.address(0)
+            linker.reference(1, 'main')
+        order += [proc for proc in self.procedures
+                  if proc.name.lower() not in ('init', 'main')]
+
+        for proc in order:
+            if proc.error is not None:
+                raise proc.error
+            base = len(code)
+            body = proc.code
+            for pos in proc.local:
+                body[pos] += base
+                linker.address(pos + base)
+            ## Optimization: there is no JMP from init to main.
+            code.extend(body if proc is not init else body[:-1])
+            for pos, name in proc.calls:
+                linker.reference(pos + base, name)
+            if not linker.define(proc.name.lower(), base):
+                raise CodeError(
+                    f'Procedure {proc.name} defined more than once')
+
+        undefined = linker.undefined()
+        if undefined:
+            raise CodeError(f'Undefined procedure {undefined[0]}')
+        linker.link(code)
+
+        ## Add the End-of-code opcode for completeness
+        ## (And compatibility with lower versions.)
+        code.append(Opcodes.EOC)
+        return code
+
+
+    def procedure(self):
+        self.expect(Tokens.IDENTIFIER)
+        self.proc = Procedure(self.last_lexeme, self.last_offset)
+        self.procedures.append(self.proc)
+        if self.token_is(Tokens.LBRACE):
+            self.statement()
+        else:
+            self.expect(Tokens.LBRACE)
+        self.proc.code.append(Opcodes.JMP)
+
+
+    def statement(self):
+        code = self.proc.code
+        if self.accept(Tokens.LBRACE):
+            while not self.token_is(Tokens.RBRACE):
+                self.statement()
+            self.expect(Tokens.RBRACE)
+        elif self.accept(Tokens.VAR):
+            start = len(code)
+            code.append(self.var_opcode(self.last_lexeme))
+            self.expect(Tokens.ASSIGN)
+            self.logical_expr()
+            code.append(Opcodes.ASS)
+            if self.version.value >= Versions.V2_1_0.value:
+                CodeGenerator.step(code, start)
+            self.expect(Tokens.SEMICOLON)
+        elif self.accept(Tokens.IDENTIFIER):
+            if self.last_lexeme == 'sleep' and not self.user_sleep:
+                self.sleep()
+                return
+            call = self.open_call(self.last_lexeme, self.last_offset)
+            if self.accept(Tokens.LPAREN):
+                self.logical_expr()
+                call[4] += 1
+                while self.accept(Tokens.COMMA):
+                    self.logical_expr()
+                    call[4] += 1
+                self.expect(Tokens.RPAREN)
+            self.close_call(call)
+            self.expect(Tokens.SEMICOLON)
+        elif self.accept(Tokens.IF):
+            self.expect(Tokens.LPAREN)
+            self.logical_expr()
+            self.expect(Tokens.RPAREN)
+            else_pos = self.placeholder(Opcodes.JIZ)
+            ends = []
+            self.statement()
+            while self.accept(Tokens.ELSE):
+                code[else_pos] = len(code) + 2
+                ends.append(self.placeholder(Opcodes.JMP))
+                if self.accept(Tokens.IF):
+                    self.expect(Tokens.LPAREN)
+                    self.logical_expr()
+                    self.expect(Tokens.RPAREN)
+                    else_pos = self.placeholder(Opcodes.JIZ)
+                    self.statement()
+                else:
+                    else_pos = None
+                    self.statement()
+                    break
+            if else_pos is not None:
+                ends.append(else_pos)
+            for pos in ends:
+                code[pos] = len(code)
+        elif self.accept(Tokens.WHILE):
+            start = len(code)
+            self.expect(Tokens.LPAREN)
+            self.logical_expr()
+            self.expect(Tokens.RPAREN)
+            end_pos = self.placeholder(Opcodes.JIZ)
+            self.statement()
+            self.proc.local.append(len(code))
+            code.append(start)
+            code.append(Opcodes.JMP)
+            code[end_pos] = len(code)
+        elif self.accept(Tokens.RETURN):
+            code.append(Opcodes.JMP)
+            self.expect(Tokens.SEMICOLON)
+        else:
+            raise self.error()
+
+
+    def sleep(self):
+        proc = self.proc
+        code = proc.code
+        offset = self.last_offset
+        start = len(code)
+        error = proc.error, proc.error_offset
+        actual_args = 0
+        if self.accept(Tokens.LPAREN):
+            self.logical_expr()
+            actual_args += 1
+            while self.accept(Tokens.COMMA):
+                self.logical_expr()
+                actual_args += 1
+            self.expect(Tokens.RPAREN)
+        self.expect(Tokens.SEMICOLON)
+        if self.version.value < Versions.V2_1_0.value:
+            ## Versions without SLEEP emit nothing for the call, so the
+            ## arguments are dropped along with any error they raised;
+            ## more than one is still an error, as in
+            ## CodeGenerator.handle_sleep.
+            proc.error, proc.error_offset = error
+            del code[start:]
+            proc.local = [pos for pos in proc.local if pos < start]
+            proc.calls = [(pos, name) for pos, name in proc.calls
+                          if pos < start]
+        if actual_args > 1:
+            line, column = self.lines.position(offset)
+            self.fail(offset, CodeError(
+                f'Expected 1 parameters for sleep. ' +
+                f'Instead, got {actual_args} on ' +
+                f'{line},{column}'))
+        if self.version.value < Versions.V2_1_0.value:
+            return
+        if not actual_args:
+            code.append(0)
+        code.append(Opcodes.SLEEP)
+
+
+    def defines(self, name):
+        ## Whether the program has a procedure of that name: only a
+        ## procedure definition puts a brace right after a name.
+        kinds = self.kinds.tobytes()
+        pair = bytes((Tokens.IDENTIFIER.value, Tokens.LBRACE.value))
+        pos = kinds.find(pair)
+        while pos >= 0:
+            if self.lexeme(pos).lower() == name:
+                return True
+            pos = kinds.find(pair, pos + 1)
+        return False
+
+
+    def logical_expr(self):
+        ## The expression engine of Parser.logical_expr, emitting postfix
+        ## code as operands are seen and operators are reduced.
+        code = self.proc.code
+        binary = OPERATORS
+        frames = []
+        operands = []
+        operators = []
+        compared = False
+        operand = True
+        start = True
+        while True:
+            token = self._token
+            if operand:
+                if start:
+                    if token is Tokens.PLUS:
+                        self.token()
+                        token = self._token
+                    elif token is Tokens.MINUS or token is Tokens.NOT:
+                        operators.append((UNARY,
+                                          Opcodes.NEG if token is Tokens.MINUS
+                                          else Opcodes.NOT))
+                        self.token()
+                        token = self._token
+                if token is Tokens.VAR:
+                    operands.append((OTHER, len(code)))
+                    code.append(self.var_opcode(self.lexeme(self.pos)))
+                elif token is Tokens.INTEGER:
+                    operands.append((LITERAL, len(code)))
+                    code.append(int(self.lexeme(self.pos)))
+                elif token is Tokens.IDENTIFIER:
+                    call = self.open_call(self.lexeme(self.pos),
+                                          self.stream.starts[self.pos])
+                    self.token()
+                    if self.accept(Tokens.LPAREN):
+                        frames.append((call, operands, operators, compared))
+                        operands, operators = [], []
+                        compared = False
+                        start = True
+                    else:
+                        self.close_call(call)
+                        operands.append((OTHER, call[3]))
+                        operand = False
+                    continue
+                elif token is Tokens.LPAREN:
+                    self.token()
+                    frames.append((len(code), operands, operators, compared))
+                    operands, operators = [], []
+                    compared = False
+                    start = True
+                    continue
+                else:
+                    raise self.error()
+                self.token()
+                operand = False
+                continue
+
+            entry = binary.get(token)
+            if (entry is not None and
+                not (compared and entry[0] == COMPARISON)):
+                level = entry[0]
+                self.token()
+                while operators and operators[-1][0] >= level:
+                    self.reduce(operands, operators)
+                operators.append(entry)
+                if level == LOGICAL:
+                    compared = False
+                elif level == COMPARISON:
+                    compared = True
+                operand = True
+                start = level <= COMPARISON
+                continue
+
+            ## Anything else ends the innermost (sub)expression.
+            while operators:
+                self.reduce(operands, operators)
+            result = operands[0]
+            if not frames:
+                return
+            call, operands, operators, compared = frames.pop()
+            if type(call) is int:
+                self.expect(Tokens.RPAREN)
+                operands.append(result)
+                continue
+            call[4] += 1
+            if self.accept(Tokens.COMMA):
+                frames.append((call, operands, operators, compared))
+                operands, operators = [], []
+                compared = False
+                operand = start = True
+                continue
+            self.expect(Tokens.RPAREN)
+            self.close_call(call)
+            operands.append((OTHER, call[3]))
+
+
+    def reduce(self, operands, operators):
+        code = self.proc.code
+        level, opcode = operators.pop()
+        if level == UNARY:
+            kind, start = operands[-1]
+            if kind == LITERAL:
+                ## Unary operation optimization for integer operand
+                code[-1] = (-code[-1] if opcode == Opcodes.NEG else
+                            int(not code[-1]))
+            else:
+                code.append(opcode)
+            operands[-1] = (OTHER, start)
+            return
+        kind, right = operands.pop()
+        kind, left = operands[-1]
+        if opcode == Opcodes.AND and kind == OR:
+            ## '&' takes the right operand of the '|' instead: move the
+            ## OR ending the left operand behind the AND.
+            self.remove(right - 1)
+            code.append(Opcodes.AND)
+            code.append(Opcodes.OR)
+        else:
+            code.append(opcode)
+            operands[-1] = (OR if opcode == Opcodes.OR else OTHER, left)
+
+
+    def open_call(self, name, offset):
+        code = self.proc.code
+        opcode = CodeGenerator.CALL_MAP.get(name)
+        call = [name, offset, opcode, len(code), 0]
+        if opcode is not None and Opcodes.is_procedure(opcode):
+            code.append(opcode)
+        return call
+
+
+    def close_call(self, call):
+        name, offset, opcode, start, actual_args = call
+        code = self.proc.code
+        expected_args = 0 if opcode is None else Opcodes.nargs(opcode)
+        if (expected_args != actual_args and
+            not (Opcodes.is_special(opcode) and actual_args == 0)):
+            line, column = self.lines.position(offset)
+            self.fail(offset, CodeError(
+                f'Expected {expected_args} ' +
+                f'parameters for {name}. '+
+                f'Instead, got {actual_args} on ' +
+                f'{line},{column}'))
+        if opcode is None:
+            self.proc.local.append(len(code))
+            code.append(len(code) + 3) #Return address
+            self.proc.calls.append((len(code), name.lower()))
+            code.append(None)
+            code.append(Opcodes.JMP)
+        elif Opcodes.is_procedure(opcode):
+            if actual_args == 1:
+                code.append(Opcodes.ASS)
+        else:
+            code.append(opcode)
+
+
+    def fail(self, offset, error):
+        ## Keep the error met first in source order, which is the one the
+        ## tree walking generator reports; parse errors still come first.
+        proc = self.proc
+        if proc.error is None or offset < proc.error_offset:
+            proc.error = error
+            proc.error_offset = offset
+
+
+    def placeholder(self, opcode):
+        code = self.proc.code
+        self.proc.local.append(len(code))
+        code.append(0)
+        code.append(opcode)
+        return len(code) - 2
+
+
+    def remove(self, pos):
+        proc = self.proc
+        code = proc.code
+        del code[pos]
+        proc.local = [p - (p > pos) for p in proc.local]
+        for p in proc.local:
+            if code[p] > pos:
+                code[p] -= 1
+        proc.calls = [(p - (p > pos), name) for p, name in proc.calls]
+
+
+    def expect(self, token):
+        if self._token is not token:
+            raise self.error(token)
+        self.token()
+
+
+    def accept(self, token):
+        if self._token is token:
+            self.token()
+            return True
+        return False
+
+
+    def var_opcode(self, lexeme):
+        return Opcodes.A + (ord(lexeme.lower()) - ord('a'))
+
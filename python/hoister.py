@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+
+from callgraph import CallGraph
+from code import CodeError, CodeGenerator
+from opcodes import Opcodes
+from parser import Node, Nodes
+from tokenizer import TokenStream
+
+
+class Hoister(object):
+    ## Functions whose result depends on nothing but their arguments;
+    ## every other call reads the world, 'random' or a user procedure.
+    PURE = (Opcodes.ARCT, Opcodes.SQRT)
+
+    def __init__(self, syntax_tree, speed=False):
+        self.syntax_tree = syntax_tree
+        self.speed = speed
+
+
+    def hoist(self):
+        ## Returns a new tree where expressions a while loop computes
+        ## again and again to the same value are computed once before it,
+        ## into a variable the program never uses. The input is never
+        ## modified.
+        root = self.syntax_tree
+        used = set()
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            if node.node_type == Nodes.VAR:
+                used.add(node.lexeme.lower())
+            stack.extend(node.nodes)
+        self.spare = sorted(TokenStream.variables - used, reverse=True)
+        self.assigned = self.assignments(root)
+        ## Expression shapes by number, and id(node) -> (node, number)
+        self.shapes = {}
+        self.keys = {}
+        return root.copy([node.copy(self.block(node.nodes))
+                          for node in root.nodes])
+
+
+    def assignments(self, root):
+        ## Procedure name -> variables it may assign, directly or through
+        ## the procedures it calls
+        graph = CallGraph(root)
+        assigned = {}
+        for node in root.nodes:
+            names = assigned.setdefault(node.lexeme.lower(), set())
+            stack = list(node.nodes)
+            while stack:
+                child = stack.pop()
+                if self.is_assignment(child):
+                    names.add(child.nodes[0].lexeme.lower())
+                stack.extend(child.nodes)
+        changed = True
+        while changed:
+            changed = False
+            for name, callees in graph.calls.items():
+                names = assigned[name]
+                size = len(names)
+                for callee in callees:
+                    names |= assigned.get(callee, set())
+                changed |= len(names) != size
+        return assigned
+
+
+    def block(self, nodes):
+        statements = []
+        for node in nodes:
+            if node.node_type == Nodes.WHILE:
+                statements.extend(self.loop(node))
+            elif node.node_type == Nodes.IF:
+                statements.append(self.branches(node))
+            else:
+                statements.append(node)
+        return statements
+
+
+    def branches(self, node):
+        return node.copy([
+            child.copy(self.block(child.nodes))
+            if child.node_type == Nodes.BLOCK else
+            self.branches(child)
+            if child.node_type == Nodes.IF else child
+            for child in node.nodes])
+
+
+    def loop(self, node):
+        ## The assignments computing hoisted values, then the loop using
+        ## them; inner loops hoist what is left into the outer loop body.
+        assigned = set()
+        stack = [node]
+        while stack:
+            child = stack.pop()
+            if self.is_assignment(child):
+                assigned.add(child.nodes[0].lexeme.lower())
+            elif (child.node_type == Nodes.CALL and
+                  child.lexeme not in CodeGenerator.CALL_MAP):
+                assigned |= self.assigned.get(child.lexeme.lower(), set())
+            stack.extend(child.nodes)
+
+        found = {}
+        for expression in self.expressions(node):
+            self.collect(expression, assigned, found)
+        temps = {}
+        statements = []
+        for key, (expression, count) in found.items():
+            if not self.spare:
+                break
+            size = self.size(expression)
+            if size is None or size < 2:
+                continue
+            ## Each use becomes one word, at the cost of assigning the
+            ## value once before the loop.
+            if not self.speed and (count - 1) * (size - 1) < 3:
+                continue
+            var = Node(Nodes.VAR, expression.offset, self.spare.pop(), (),
+                       expression.lines)
+            temps[key] = var
+            statements.append(Node(Nodes.OPERATOR, expression.offset, '=',
+                                   (var, expression), expression.lines))
+
+        cond, body = node.nodes
+        if temps:
+            cond = self.replace(cond, temps)
+            body = body.copy([self.statement(child, temps)
+                              for child in body.nodes])
+        body = body.copy(self.block(body.nodes))
+        statements.append(node.copy([cond, body]))
+        return statements
+
+
+    def expressions(self, node):
+        ## Every expression evaluated in a statement, nested ones included
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if node.node_type in (Nodes.IF, Nodes.WHILE):
+                yield node.nodes[0]
+                stack.extend(node.nodes[1:])
+            elif node.node_type == Nodes.BLOCK:
+                stack.extend(node.nodes)
+            elif self.is_assignment(node):
+                yield node.nodes[1]
+            elif node.node_type == Nodes.CALL:
+                yield from node.nodes
+
+
+    def collect(self, node, assigned, found):
+        ## Largest invariant subexpressions, counted by their shape
+        invariant = self.invariants(node, assigned)
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if node.node_type in (Nodes.OPERATOR, Nodes.CALL):
+                if invariant[id(node)]:
+                    key = self.key(node)
+                    expression, count = found.get(key, (node, 0))
+                    found[key] = (expression, count + 1)
+                    continue
+                stack.extend(reversed(node.nodes))
+
+
+    def invariants(self, root, assigned):
+        ## id(node) -> whether the node computes the same value on every
+        ## pass, for every node of the expression, worked out bottom up
+        invariant = {}
+        stack = [(root, False)]
+        while stack:
+            node, ready = stack.pop()
+            if not ready and node.nodes:
+                stack.append((node, True))
+                stack.extend((child, False) for child in node.nodes)
+                continue
+            if node.node_type == Nodes.INTEGER:
+                value = True
+            elif node.node_type == Nodes.VAR:
+                value = node.lexeme.lower() not in assigned
+            elif node.node_type == Nodes.OPERATOR:
+                value = all(invariant[id(child)] for child in node.nodes)
+                if node.lexeme in ('/', '%'):
+                    ## Computing it before the loop must not divide by
+                    ## zero where the loop would not have divided at all.
+                    divisor = node.nodes[1]
+                    if (divisor.node_type != Nodes.INTEGER or
+                        not int(divisor.lexeme)):
+                        value = False
+            elif node.node_type == Nodes.CALL:
+                value = (CodeGenerator.CALL_MAP.get(node.lexeme) in
+                         self.PURE and
+                         all(invariant[id(child)] for child in node.nodes))
+            else:
+                value = False
+            invariant[id(node)] = value
+        return invariant
+
+
+    def key(self, node):
+        ## A number standing for the shape of the expression, the same for
+        ## expressions of the same shape. Shapes are numbered bottom up and
+        ## kept per node, so a key is small however deep the expression.
+        keys = self.keys
+        stack = [(node, False)]
+        while stack:
+            child, ready = stack.pop()
+            if id(child) in keys:
+                continue
+            if not ready:
+                stack.append((child, True))
+                stack.extend((grandchild, False)
+                             for grandchild in child.nodes)
+                continue
+            if child.node_type == Nodes.INTEGER:
+                shape = (Nodes.INTEGER, int(child.lexeme))
+            elif child.node_type == Nodes.VAR:
+                shape = (Nodes.VAR, child.lexeme.lower())
+            else:
+                shape = (child.node_type, child.lexeme,
+                         tuple(keys[id(grandchild)][1]
+                               for grandchild in child.nodes))
+            keys[id(child)] = (child,
+                               self.shapes.setdefault(shape,
+                                                      len(self.shapes)))
+        return keys[id(node)][1]
+
+
+    def statement(self, node, temps):
+        if node.node_type in (Nodes.IF, Nodes.WHILE):
+            return node.copy([
+                self.statement(child, temps)
+                if child.node_type in (Nodes.IF, Nodes.BLOCK) else
+                self.replace(child, temps)
+                for child in node.nodes])
+        elif node.node_type == Nodes.BLOCK:
+            return node.copy([self.statement(child, temps)
+                              for child in node.nodes])
+        elif self.is_assignment(node):
+            var, value = node.nodes
+            return node.copy([var, self.replace(value, temps)])
+        elif node.node_type == Nodes.CALL:
+            return node.copy([self.replace(child, temps)
+                              for child in node.nodes])
+        return node
+
+
+    def replace(self, node, temps):
+        ## Bottom up with a stack of its own, like Optimizer.expression;
+        ## what a variable now holds is not looked into.
+        done = []
+        stack = [(node, False)]
+        while stack:
+            node, ready = stack.pop()
+            if ready:
+                nodes = done[len(done) - len(node.nodes):]
+                del done[len(done) - len(node.nodes):]
+                done.append(node.copy(nodes))
+            elif node.node_type not in (Nodes.OPERATOR, Nodes.CALL):
+                done.append(node)
+            else:
+                var = temps.get(self.key(node))
+                if var is not None:
+                    done.append(var)
+                else:
+                    stack.append((node, True))
+                    stack.extend((child, False)
+                                 for child in reversed(node.nodes))
+        return done[0]
+
+
+    def size(self, node):
+        codegen = CodeGenerator(None)
+        try:
+            codegen.expression(node)
+        except CodeError:
+            return None
+        return len(codegen.code)
+
+
+    def is_assignment(self, node):
+        return node.node_type == Nodes.OPERATOR and node.lexeme == '='
+
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from parser import Parser
+    from utils import BOT_HEADER, bot_source
+
+    parser = argparse.ArgumentParser(
+        description='Report bytecode size before and after hoisting loop '
+                    'invariant expressions')
+    parser.add_argument('file', metavar='FILE')
+    parser.add_argument('--speed', action='store_true',
+                        help='Hoist even where the code grows')
+    args = parser.parse_args()
+
+    with open(args.file, 'rb') as f:
+        data = f.read()
+    source = (bot_source(data) if data.startswith(BOT_HEADER)
+              else str(data, 'ascii'))
+    tree = Parser(source).parse()
+    before = CodeGenerator(tree).generate()
+    after = CodeGenerator(Hoister(tree, args.speed).hoist()).generate()
+    print(f'{len(before)} words before, {len(after)} after hoisting.')
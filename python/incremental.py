@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+
+from parser import Node, Nodes, Parser
+from tokenizer import LineIndex, TokenStream, Tokens
+
+
+class IncrementalParser(object):
+    ## Reparses only the top-level procedures whose text changed since the
+    ## last parse, and lexes only from the last procedure before the edit
+    ## up to the first one after it. Trees handed out are never modified:
+    ## procedures before the edit are shared as they are, and reused ones
+    ## further on are copied with their new offsets.
+    def __init__(self, source):
+        self.clear()
+        self.update(source)
+
+
+    def update(self, source):
+        self.source = source
+        self.reset()
+
+
+    def reset(self):
+        self.reused = 0
+        self.reparsed = 0
+
+
+    def clear(self):
+        ## Procedure subtrees by their text, and the (start, end, node)
+        ## of each procedure in the source last parsed
+        self.cache = {}
+        self.procedures = None
+        self.parsed = None
+
+
+    def parse(self):
+        source = self.source
+        self.lines = LineIndex(source)
+        self.reset()
+        head, tail, delta, resume, start = [], [], 0, {}, 0
+        old = self.parsed
+        if self.procedures is not None:
+            procedures = self.procedures
+            prefix = common_prefix(old, source)
+            suffix = common_suffix(old, source,
+                                   min(len(old), len(source)) - prefix)
+            delta = len(source) - len(old)
+            ## Lexing resumes after the last procedure ending before the
+            ## edit, and stops at the first procedure after it that the
+            ## new tokens line up with again.
+            k = 0
+            while k < len(procedures) and procedures[k][1] <= prefix:
+                k += 1
+            head = procedures[:k]
+            if k:
+                start = head[-1][1]
+            edited = len(old) - suffix
+            resume = {begin + delta: j
+                      for j, (begin, _, _) in enumerate(procedures)
+                      if j >= k and begin >= edited}
+
+        found = self.split(start, resume)
+        if found is None:
+            ## Not a plain sequence of procedures; let the full parser
+            ## report the error (or parse whatever it accepts).
+            self.clear()
+            parser = Parser(source)
+            parser.lines = self.lines
+            return parser.parse()
+        spans, j = found
+        if j is not None:
+            tail = self.procedures[j:]
+
+        procedures = [(begin, end, node) for begin, end, node in head]
+        self.reused += len(head)
+        for begin, end in spans:
+            cached = self.cache.get(source[begin:end])
+            if cached is not None:
+                node, old_start = cached
+                node = self.move(node, begin - old_start)
+                self.reused += 1
+            else:
+                parser = Parser(source, begin, end)
+                parser.lines = self.lines
+                node = parser.parse().nodes[0]
+                self.reparsed += 1
+            procedures.append((begin, end, node))
+        for begin, end, node in tail:
+            procedures.append((begin + delta, end + delta,
+                               self.move(node, delta)))
+            self.reused += 1
+
+        root = Node(Nodes.PROGRAM, lines=self.lines)
+        cache = {}
+        for begin, end, node in procedures:
+            cache.setdefault(source[begin:end], (node, begin))
+            root.add_nodes(node)
+        self.cache = cache
+        self.procedures = procedures
+        self.parsed = source
+        return root
+
+
+    def split(self, start, resume):
+        ## (start, end) of each procedure from start on, up to the first
+        ## one starting where resume says an old one now starts; then the
+        ## index of that old procedure, or None at the end of the source.
+        ## None when the tokens are not a plain sequence of procedures.
+        IDENTIFIER = Tokens.IDENTIFIER.value
+        LBRACE = Tokens.LBRACE.value
+        RBRACE = Tokens.RBRACE.value
+        spans = []
+        tokens = TokenStream.scan(self.source, False, start)
+        for kind, first, _ in tokens:
+            if first in resume:
+                return spans, resume[first]
+            if kind != IDENTIFIER or next(tokens, (None,))[0] != LBRACE:
+                return None
+            depth = 1
+            for kind, _, last in tokens:
+                if kind == LBRACE:
+                    depth += 1
+                elif kind == RBRACE:
+                    depth -= 1
+                    if not depth:
+                        break
+            else:
+                return None
+            spans.append((first, last))
+        return spans, None
+
+
+    def move(self, root, delta):
+        ## A copy of the subtree delta characters further on, placed in
+        ## the current source
+        lines = self.lines
+        copies = {}
+        stack = [(root, False)]
+        while stack:
+            node, done = stack.pop()
+            if not done:
+                stack.append((node, True))
+                stack.extend((child, False) for child in node.nodes)
+                continue
+            copies[id(node)] = Node(
+                node.node_type,
+                None if node.offset is None else node.offset + delta,
+                node.lexeme, [copies.pop(id(child)) for child in node.nodes],
+                lines)
+        return copies[id(root)]
+
+
+def common_prefix(a, b):
+    ## Length of the longest common prefix, found by halving so the
+    ## comparisons run in C
+    low, high = 0, min(len(a), len(b))
+    while low < high:
+        mid = (low + high + 1) // 2
+        if a[low:mid] == b[low:mid]:
+            low = mid
+        else:
+            high = mid - 1
+    return low
+
+
+def common_suffix(a, b, limit):
+    low, high = 0, limit
+    while low < high:
+        mid = (low + high + 1) // 2
+        if a[len(a) - mid:len(a) - low] == b[len(b) - mid:len(b) - low]:
+            low = mid
+        else:
+            high = mid - 1
+    return low
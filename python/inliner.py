@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+
+from callgraph import CallGraph
+from code import CodeError, CodeGenerator
+from parser import Node, Nodes
+
+
+class Inliner(object):
+    ## A call costs the return address, the target and a JMP at the call
+    ## site, and the JMP returning at the end of the procedure.
+    CALL_COST = 3
+    RETURN_COST = 1
+    ## Largest body expanded when favoring speed over size
+    SPEED_LIMIT = 32
+
+    def __init__(self, syntax_tree, speed=False):
+        self.syntax_tree = syntax_tree
+        self.speed = speed
+
+
+    def inline(self):
+        ## Returns a new tree where statement calls to small, non
+        ## recursive procedures are replaced with their bodies. The
+        ## procedures themselves stay; CallGraph.prune drops the ones
+        ## nothing calls anymore.
+        root = self.syntax_tree
+        graph = CallGraph(root)
+        recursive = {name for cycle in graph.cycles() for name in cycle}
+        procedures = {}
+        for node in root.nodes:
+            procedures.setdefault(node.lexeme.lower(), []).append(node)
+        calls, statement_calls = self.count_calls(root)
+
+        self.bodies = {}
+        bodies = {}
+        for component in graph.components():
+            for name in component:
+                if len(procedures[name]) > 1:
+                    continue
+                body = self.block(procedures[name][0].nodes)
+                bodies[name] = body
+                if (name in recursive or name in CallGraph.ROOTS or
+                    calls.get(name) is None):
+                    continue
+                inlined = self.inlinable(body)
+                if inlined is None:
+                    continue
+                size = self.size(inlined)
+                if size is None:
+                    continue
+                if calls[name] == statement_calls.get(name, 0):
+                    ## Every call goes, and the procedure with them
+                    smaller = (calls[name] * size <= size +
+                               self.RETURN_COST +
+                               calls[name] * self.CALL_COST)
+                else:
+                    smaller = size <= self.CALL_COST
+                if smaller or self.speed and size <= self.SPEED_LIMIT:
+                    self.bodies[name] = inlined
+
+        nodes = [node if node.lexeme.lower() not in bodies else
+                 node.copy(bodies[node.lexeme.lower()])
+                 for node in root.nodes]
+        return root.copy(nodes)
+
+
+    def count_calls(self, root):
+        calls = {}
+        statement_calls = {}
+        graph = CallGraph(root)
+        for node in root.nodes:
+            for name in graph.call_sites(node):
+                calls[name] = calls.get(name, 0) + 1
+            stack = list(node.nodes)
+            while stack:
+                child = stack.pop()
+                if self.is_call(child):
+                    name = child.lexeme.lower()
+                    statement_calls[name] = statement_calls.get(name, 0) + 1
+                elif child.node_type in (Nodes.IF, Nodes.WHILE, Nodes.BLOCK):
+                    stack.extend(child.nodes)
+        return calls, statement_calls
+
+
+    def block(self, nodes):
+        statements = []
+        for node in nodes:
+            if self.is_call(node) and node.lexeme.lower() in self.bodies:
+                statements.extend(self.bodies[node.lexeme.lower()])
+            elif node.node_type in (Nodes.IF, Nodes.WHILE):
+                statements.append(node.copy([
+                    child.copy(self.block(child.nodes))
+                    if child.node_type == Nodes.BLOCK else
+                    self.block([child])[0]
+                    if child.node_type == Nodes.IF else child
+                    for child in node.nodes]))
+            else:
+                statements.append(node)
+        return statements
+
+
+    def inlinable(self, body):
+        ## A return ending the body just falls through once inlined; one
+        ## anywhere else would return from the caller.
+        if body and body[-1].node_type == Nodes.RETURN:
+            body = body[:-1]
+        stack = list(body)
+        while stack:
+            node = stack.pop()
+            if node.node_type == Nodes.RETURN:
+                return None
+            elif node.node_type in (Nodes.IF, Nodes.WHILE, Nodes.BLOCK):
+                stack.extend(node.nodes)
+        return body
+
+
+    def size(self, body):
+        codegen = CodeGenerator(None)
+        try:
+            codegen.procedure(Node(Nodes.PROCEDURE, None, '', body),
+                              return_jump=False)
+        except CodeError:
+            ## Leave it to the code generator to report
+            return None
+        return len(codegen.code)
+
+
+    def is_call(self, node):
+        ## A statement calling a user procedure; a call with arguments is
+        ## an error the code generator reports.
+        return (node.node_type == Nodes.CALL and not node.nodes and
+                node.lexeme not in CodeGenerator.CALL_MAP)
+
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from parser import Parser
+    from utils import BOT_HEADER, bot_source
+
+    parser = argparse.ArgumentParser(
+        description='Report bytecode size before and after inlining')
+    parser.add_argument('file', metavar='FILE')
+    parser.add_argument('--speed', action='store_true',
+                        help='Favor fewer executed words over code size')
+    args = parser.parse_args()
+
+    with open(args.file, 'rb') as f:
+        data = f.read()
+    source = (bot_source(data) if data.startswith(BOT_HEADER)
+              else str(data, 'ascii'))
+    tree = Parser(source).parse()
+    inlined = CallGraph(Inliner(tree, args.speed).inline()).prune()
+    before = CodeGenerator(tree).generate()
+    after = CodeGenerator(inlined).generate()
+    print(f'{len(before)} words before, {len(after)} after inlining.')
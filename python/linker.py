@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+
+
+class Linker(object):
+    def __init__(self):
+        self.reset()
+
+
+    def reset(self):
+        ## Procedure name -> address of its first word
+        self.symbols = {}
+        ## (position, procedure name) pairs, one per call site
+        self.relocations = []
+        ## Positions of every word holding a code address: jump targets,
+        ## return addresses and call targets
+        self.addresses = []
+
+
+    def define(self, symbol, address):
+        if symbol in self.symbols:
+            return False
+        self.symbols[symbol] = address
+        return True
+
+
+    def reference(self, position, symbol):
+        self.relocations.append((position, symbol))
+        self.addresses.append(position)
+
+
+    def address(self, position):
+        self.addresses.append(position)
+
+
+    def undefined(self):
+        return sorted({symbol for _, symbol in self.relocations
+                       if symbol not in self.symbols})
+
+
+    def link(self, code):
+        symbols = self.symbols
+        for position, symbol in self.relocations:
+            code[position] = symbols[symbol]
+        return code
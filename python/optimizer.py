@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+
+import operator
+
+from code import CodeGenerator
+from opcodes import Opcodes
+from parser import Node, Nodes
+from utils import is_int
+
+
+class Optimizer(object):
+    ## Folds only where every reading of the VM arithmetic agrees:
+    ## '/' and '%' on non-negative operands, logical operators on 0 and 1.
+    UNARY = {
+        '~': operator.neg,
+        '!': lambda a: int(not a),
+    }
+
+    BINARY = {
+        '+': operator.add,
+        '-': operator.sub,
+        '*': operator.mul,
+        '/': lambda a, b: a // b if a >= 0 and b > 0 else None,
+        '%': lambda a, b: a % b if a >= 0 and b > 0 else None,
+        '==': lambda a, b: int(a == b),
+        '!=': lambda a, b: int(a != b),
+        '>': lambda a, b: int(a > b),
+        '<': lambda a, b: int(a < b),
+        '>=': lambda a, b: int(a >= b),
+        '<=': lambda a, b: int(a <= b),
+        '&': lambda a, b: a & b if a in (0, 1) and b in (0, 1) else None,
+        '|': lambda a, b: a | b if a in (0, 1) and b in (0, 1) else None,
+        '^': lambda a, b: a ^ b if a in (0, 1) and b in (0, 1) else None,
+    }
+
+    def __init__(self, syntax_tree):
+        self.syntax_tree = syntax_tree
+
+
+    def optimize(self):
+        ## Returns a new tree; unchanged subtrees are shared with the
+        ## input, which is never modified.
+        root = self.syntax_tree
+        return root.copy([node.copy(self.block(node.nodes))
+                          for node in root.nodes])
+
+
+    def block(self, nodes):
+        return [self.statement(node) for node in nodes]
+
+
+    def statement(self, node):
+        if node.node_type == Nodes.OPERATOR:
+            var, value = node.nodes
+            return node.copy([var, self.expression(value)])
+        elif node.node_type == Nodes.CALL:
+            return self.expression(node)
+        elif node.node_type in (Nodes.IF, Nodes.WHILE):
+            nodes = []
+            for child in node.nodes:
+                if child.node_type == Nodes.BLOCK:
+                    nodes.append(child.copy(self.block(child.nodes)))
+                elif child.node_type == Nodes.IF:
+                    nodes.append(self.statement(child))
+                else:
+                    nodes.append(self.condition(child))
+            return node.copy(nodes)
+        return node
+
+
+    def condition(self, node):
+        node = self.expression(node)
+        ## Only truth matters in a condition, so '!!x' is just 'x'.
+        while (self.is_operator(node, '!') and
+               self.is_operator(node.nodes[0], '!')):
+            node = node.nodes[0].nodes[0]
+        return node
+
+
+    def expression(self, node):
+        ## Bottom up with a stack of its own, so expressions nest as deeply
+        ## as the parser accepts them; each operator or call is folded
+        ## once its operands are.
+        done = []
+        stack = [(node, False)]
+        while stack:
+            node, ready = stack.pop()
+            if ready:
+                operands = done[len(done) - len(node.nodes):]
+                del done[len(done) - len(node.nodes):]
+                done.append(node.copy(operands)
+                            if node.node_type == Nodes.CALL else
+                            self.fold(node, operands))
+            elif node.node_type in (Nodes.CALL, Nodes.OPERATOR):
+                stack.append((node, True))
+                stack.extend((child, False) for child in reversed(node.nodes))
+            else:
+                done.append(node)
+        return done[0]
+
+
+    def fold(self, node, operands):
+        values = [self.value(child) for child in operands]
+        if None not in values:
+            if len(values) == 1:
+                result = self.UNARY[node.lexeme](*values)
+            else:
+                result = self.BINARY[node.lexeme](*values)
+            if result is not None and is_int(result):
+                return self.integer(node, result)
+
+        if len(operands) == 2:
+            (left, right), (a, b) = operands, values
+            lexeme = node.lexeme
+            if lexeme == '+':
+                if b == 0:
+                    return left
+                elif a == 0:
+                    return right
+            elif lexeme == '-':
+                if b == 0:
+                    return left
+            elif lexeme == '*':
+                if b == 1:
+                    return left
+                elif a == 1:
+                    return right
+                elif (b == 0 and self.is_pure(left) or
+                      a == 0 and self.is_pure(right)):
+                    return self.integer(node, 0)
+            elif lexeme == '/':
+                if b == 1:
+                    return left
+        return node.copy(operands)
+
+
+    def value(self, node):
+        if node.node_type == Nodes.INTEGER:
+            value = int(node.lexeme)
+            if is_int(value):
+                return value
+
+
+    def is_pure(self, node):
+        ## Whether dropping the expression drops nothing but its value:
+        ## 'random' and user procedures may change state, and so may a
+        ## call that sets a special variable.
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if node.node_type in (Nodes.INTEGER, Nodes.VAR):
+                continue
+            elif node.node_type == Nodes.OPERATOR:
+                stack.extend(node.nodes)
+            elif node.node_type == Nodes.CALL:
+                opcode = CodeGenerator.CALL_MAP.get(node.lexeme)
+                if opcode is None or opcode == Opcodes.RND:
+                    return False
+                elif Opcodes.is_procedure(opcode):
+                    if node.nodes:
+                        return False
+                else:
+                    stack.extend(node.nodes)
+            else:
+                return False
+        return True
+
+
+    def is_operator(self, node, lexeme):
+        return node.node_type == Nodes.OPERATOR and node.lexeme == lexeme
+
+
+    def integer(self, node, value):
+        return Node(Nodes.INTEGER, node.offset, str(value), (), node.lines)
+
+
+
+if __name__ == '__main__':
+    import sys
+    from parser import Parser
+
+    try:
+        with open(sys.argv[1], 'rt') as f:
+            tree = Parser(f.read()).parse()
+    except:
+        print(f'Usage: {sys.executable} {sys.argv[0]} <Source File>')
+    else:
+        before = CodeGenerator(tree).generate()
+        after = CodeGenerator(Optimizer(tree).optimize()).generate()
+        print(f'{len(before)} words before, {len(after)} after folding.')
@@ -2,13 +2,17 @@
 
 
 from enum import Enum, auto
-from tokenizer import Tokenizer, Tokens
+from tokenizer import TokenStream, Tokens
 
 
 class ParseError(ValueError):
     def __init__(self, lexeme, line, column, expected=None):
         if lexeme is None:
             lexeme = 'EOF'
+        self.lexeme = lexeme
+        self.line = line
+        self.column = column
+        self.expected = expected
         if expected is not None:
             msg = (f'Expected {expected} on {line},{column}. ' +
                    f'Instead, got {lexeme}')
@@ -31,63 +35,117 @@ class Nodes(Enum):
     WHILE = auto()
 
 
+## Binding levels of the expression operators. Unary '-' and '!' bind
+## looser than '*' because their operand is a whole term.
+LOGICAL, COMPARISON, ADDITIVE, UNARY, MULTIPLICATIVE = range(1, 6)
+
+BINARY = {
+    Tokens.OR: LOGICAL, Tokens.XOR: LOGICAL, Tokens.AND: LOGICAL,
+    Tokens.EQUAL: COMPARISON, Tokens.NOT_EQUAL: COMPARISON,
+    Tokens.GT: COMPARISON, Tokens.GT_EQUAL: COMPARISON,
+    Tokens.LT: COMPARISON, Tokens.LT_EQUAL: COMPARISON,
+    Tokens.PLUS: ADDITIVE, Tokens.MINUS: ADDITIVE,
+    Tokens.MULTIPLY: MULTIPLICATIVE, Tokens.DIVIDE: MULTIPLICATIVE,
+    Tokens.MODULO: MULTIPLICATIVE,
+}
+
 
 class Node(object):
-    def __init__(self, node_type, line=None,
-                 column=None, lexeme=None, nodes=[]):
+    __slots__ = ('node_type', 'offset', 'lexeme', 'lines', 'nodes')
+
+    def __init__(self, node_type, offset=None, lexeme=None,
+                 nodes=(), lines=None):
         self.node_type = node_type
-        if line is not None: 
-            assert(type(line) is int)
-        if column is not None: 
-            assert(type(column) is int)
-        if lexeme is not None:
-            assert(type(lexeme) is str)
-        self.line = line
-        self.column = column
+        self.offset = offset
         self.lexeme = lexeme
-        self.nodes = []
-        self.add_nodes(*nodes)
+        self.lines = lines
+        self.nodes = [node for node in nodes if node is not None]
+
+
+    def copy(self, nodes):
+        ## This node with other children, or the node itself when they
+        ## are the same ones; tree passes share what they leave alone.
+        if len(nodes) == len(self.nodes) and all(
+                new is old for new, old in zip(nodes, self.nodes)):
+            return self
+        return Node(self.node_type, self.offset, self.lexeme, nodes,
+                    self.lines)
 
 
     def add_nodes(self, *nodes):
-        self.nodes += [node for node in nodes if node is not None]
+        for node in nodes:
+            if node is not None:
+                self.nodes.append(node)
         return self
 
 
+    @property
+    def line(self):
+        if self.offset is not None and self.lines is not None:
+            return self.lines.position(self.offset)[0]
+
+
+    @property
+    def column(self):
+        if self.offset is not None and self.lines is not None:
+            return self.lines.position(self.offset)[1]
+
+
     def __str__(self):
         return f'{self.node_type.name} {self.lexeme or ""}'
 
 
 class Parser(object):
-    def __init__(self, source):
-        self.tokenizer = Tokenizer(source)
-        self._token = None
-        self._lexeme = None
-        self.last_lexeme = None
-        self.last_line = 1
-        self.last_column = 1
+    def __init__(self, source, start=0, end=None, recover=False):
+        self.stream = TokenStream(source, False, start, end)
+        self.lines = self.stream.lines
+        self.kinds = self.stream.kinds
+        self.kinds_of = self.stream.kinds_of
+        self.lexeme = self.stream.lexeme
+        self.recover = recover
+        self.reset()
 
 
     def reset(self):
-        self.tokenizer.reset()
+        self.pos = -1
         self._token = None
-        self._lexeme = None
-        self.last_lexeme = None
-        self.last_line = 1
-        self.last_column = 1
+        self.errors = []
+        self.resync = False
+
+
+    @property
+    def last_lexeme(self):
+        return self.lexeme(self.pos - 1)
+
+
+    @property
+    def last_offset(self):
+        return self.stream.starts[self.pos - 1]
 
 
     def parse(self):
-        root = Node(Nodes.PROGRAM)
+        root = self.node(Nodes.PROGRAM)
         self.token()
         while not self.token_is(None):
-            root.add_nodes(self.procedure())
+            if not self.recover:
+                root.add_nodes(self.procedure())
+                continue
+            pos = self.pos
+            self.resync = False
+            try:
+                root.add_nodes(self.procedure())
+            except ParseError as e:
+                self.errors.append(e)
+                if self.pos == pos:
+                    self.token()
+                while not (self.token_is(None) or self.at_procedure()):
+                    self.token()
         return root
 
 
     def procedure(self):
         name = self.expect(Tokens.IDENTIFIER)
-        node = Node(Nodes.PROCEDURE, self.last_line, self.last_column, name) 
+        node = self.node(Nodes.PROCEDURE, self.last_offset, name) 
         if self.token_is(Tokens.LBRACE):
             node.add_nodes(*self.statement())
         else:
@@ -98,29 +156,35 @@ class Parser(object):
     def statement(self):
         if self.accept(Tokens.LBRACE):
             statements = []
-            while not self.token_is(Tokens.RBRACE):
-                res = self.statement()
+            while not self.resync and not self.token_is(Tokens.RBRACE):
+                try:
+                    res = self.statement()
+                except ParseError as e:
+                    if not self.recover:
+                        raise
+                    self.errors.append(e)
+                    self.synchronize()
+                    continue
                 if type(res) is list:
                     statements += res
                 else:
                     assert(isinstance(res, Node))
                     statements.append(res)
-            self.expect(Tokens.RBRACE)
+            if not self.resync:
+                self.expect(Tokens.RBRACE)
             return statements
         elif self.accept(Tokens.VAR):
             var = self.last_lexeme
-            line = self.last_line
-            column = self.last_column
+            offset = self.last_offset
             self.expect(Tokens.ASSIGN)
-            node = Node(Nodes.OPERATOR, self.last_line, self.last_column, '=',
-                        (Node(Nodes.VAR, line, column, var),
-                         self.logical_expr()))
+            node = self.node(Nodes.OPERATOR, self.last_offset, '=',
+                             (self.node(Nodes.VAR, offset, var),
+                              self.logical_expr()))
             self.expect(Tokens.SEMICOLON)
             return node
         elif self.accept(Tokens.IDENTIFIER):
             proc = self.last_lexeme
-            line = self.last_line
-            column = self.last_column
+            offset = self.last_offset
             args = []
             if self.accept(Tokens.LPAREN):
                 arg = self.logical_expr()
@@ -129,24 +193,23 @@ class Parser(object):
                 while self.accept(Tokens.COMMA):  
                     args.append(self.logical_expr())
                 self.expect(Tokens.RPAREN)
-            node = Node(Nodes.CALL, line, column, proc, args)
+            node = self.node(Nodes.CALL, offset, proc, args)
             self.expect(Tokens.SEMICOLON)
             return node
         elif self.accept(Tokens.IF):
-            line = self.last_line
-            column = self.last_column
+            offset = self.last_offset
             self.expect(Tokens.LPAREN)
             cond = self.logical_expr()
             self.expect(Tokens.RPAREN)
             body = self.statement()
             if isinstance(body, Node):
                 body = [body]
-            node = Node(Nodes.IF, line, column, None,
-                        (cond, Node(Nodes.BLOCK, line, column, None, body)))
+            node = self.node(Nodes.IF, offset, None,
+                             (cond, self.node(Nodes.BLOCK, offset, None,
+                                              body)))
             while self.accept(Tokens.ELSE):
                 if self.accept(Tokens.IF):
-                    line = self.last_line
-                    column = self.last_column
+                    offset = self.last_offset
                     self.expect(Tokens.LPAREN)
                     cond = self.logical_expr()
                     self.expect(Tokens.RPAREN)
@@ -154,145 +217,193 @@ class Parser(object):
                     if isinstance(body, Node):
                         body = [body]
                     node.add_nodes(
-                        Node(Nodes.IF, line, column, None,
-                             (cond, Node(Nodes.BLOCK, line, column, None,
-                                         body))))
+                        self.node(Nodes.IF, offset, None,
+                                  (cond, self.node(Nodes.BLOCK, offset, None,
+                                                   body))))
                 else:
                     body = self.statement()
                     if isinstance(body, Node):
                         body = [body]
-                    node.add_nodes(Node(Nodes.BLOCK, line, column, None, body))
+                    node.add_nodes(self.node(Nodes.BLOCK, offset, None, body))
                     break
             return node
         elif self.accept(Tokens.WHILE):
-            line = self.last_line
-            column = self.last_column
+            offset = self.last_offset
             self.expect(Tokens.LPAREN)
             cond = self.logical_expr()
             self.expect(Tokens.RPAREN)
             body = self.statement()
             if isinstance(body, Node):
                 body = [body]
-            return Node(Nodes.WHILE, line, column, None,
-                        (cond, Node(Nodes.BLOCK, line, column, None, body)))
+            return self.node(Nodes.WHILE, offset, None,
+                             (cond, self.node(Nodes.BLOCK, offset, None,
+                                              body)))
         elif self.accept(Tokens.RETURN):
-            node = Node(Nodes.RETURN, self.last_line, self.last_column)
+            node = self.node(Nodes.RETURN, self.last_offset)
             self.expect(Tokens.SEMICOLON)
             return node
         else:
-            raise ParseError(self._lexeme,
-                             self.tokenizer.line(),
-                             self.tokenizer.column())
+            raise self.error()
 
 
-    def factor(self):
-        if self.accept(Tokens.VAR):
-            return Node(Nodes.VAR,
-                        self.last_line,
-                        self.last_column,
-                        self.last_lexeme)
-        elif self.accept(Tokens.IDENTIFIER):
-            node = Node(Nodes.CALL,
-                        self.last_line,
-                        self.last_column,
-                        self.last_lexeme)
-            if self.accept(Tokens.LPAREN):
-                node.add_nodes(self.logical_expr())
-                while self.accept(Tokens.COMMA):
-                    node.add_nodes(self.logical_expr())
+    def logical_expr(self):
+        ## Operator precedence parsing with explicit stacks. Parenthesised
+        ## expressions and call arguments push a frame instead of
+        ## recursing, so nesting depth is bounded only by memory.
+        binary = BINARY
+        starts = self.stream.starts
+        frames = []
+        operands = []
+        operators = []
+        compared = False
+        operand = True
+        start = True
+        while True:
+            token = self._token
+            if operand:
+                if start:
+                    if token is Tokens.PLUS:
+                        self.token()
+                        token = self._token
+                    elif token is Tokens.MINUS or token is Tokens.NOT:
+                        operators.append((UNARY,
+                                          '~' if token is Tokens.MINUS
+                                          else '!',
+                                          starts[self.pos]))
+                        self.token()
+                        token = self._token
+                if token is Tokens.VAR:
+                    operands.append(self.node(Nodes.VAR, starts[self.pos],
+                                              self.lexeme(self.pos)))
+                elif token is Tokens.INTEGER:
+                    operands.append(self.node(Nodes.INTEGER,
+                                              starts[self.pos],
+                                              self.lexeme(self.pos)))
+                elif token is Tokens.IDENTIFIER:
+                    node = self.node(Nodes.CALL, starts[self.pos],
+                                     self.lexeme(self.pos))
+                    self.token()
+                    if self.accept(Tokens.LPAREN):
+                        frames.append((node, operands, operators, compared))
+                        operands, operators = [], []
+                        compared = False
+                        start = True
+                    else:
+                        operands.append(node)
+                        operand = False
+                    continue
+                elif token is Tokens.LPAREN:
+                    self.token()
+                    frames.append((None, operands, operators, compared))
+                    operands, operators = [], []
+                    compared = False
+                    start = True
+                    continue
+                else:
+                    raise self.error()
+                self.token()
+                operand = False
+                continue
+
+            level = binary.get(token)
+            if level is not None and not (compared and level == COMPARISON):
+                offset = starts[self.pos]
+                lexeme = self.lexeme(self.pos)
+                self.token()
+                while operators and operators[-1][0] >= level:
+                    self.reduce(operands, operators)
+                operators.append((level, lexeme, offset))
+                if level == LOGICAL:
+                    compared = False
+                elif level == COMPARISON:
+                    compared = True
+                operand = True
+                start = level <= COMPARISON
+                continue
+
+            ## Anything else ends the innermost (sub)expression.
+            while operators:
+                self.reduce(operands, operators)
+            node = operands[0]
+            if not frames:
+                return node
+            call, operands, operators, compared = frames.pop()
+            if call is None:
                 self.expect(Tokens.RPAREN)
-            return node
-        elif self.accept(Tokens.INTEGER):
-            return Node(Nodes.INTEGER,
-                        self.last_line,
-                        self.last_column,
-                        self.last_lexeme)
-        elif self.accept(Tokens.LPAREN):
-            node = self.logical_expr()
+                operands.append(node)
+                continue
+            call.add_nodes(node)
+            if self.accept(Tokens.COMMA):
+                frames.append((call, operands, operators, compared))
+                operands, operators = [], []
+                compared = False
+                operand = start = True
+                continue
             self.expect(Tokens.RPAREN)
-            return node
+            operands.append(call)
+
+
+    def reduce(self, operands, operators):
+        level, lexeme, offset = operators.pop()
+        if level == UNARY:
+            operands[-1] = self.node(Nodes.OPERATOR, offset, lexeme,
+                                     (operands[-1],))
+            return
+        right = operands.pop()
+        left = operands[-1]
+        if (lexeme == '&' and left.node_type == Nodes.OPERATOR and
+            left.lexeme == '|'):
+            left.nodes[-1] = self.node(Nodes.OPERATOR, offset, '&',
+                                       (left.nodes[-1], right))
         else:
-            raise ParseError(self._lexeme,
-                             self.tokenizer.line(),
-                             self.tokenizer.column())
-
-
-    def logical_expr(self):
-        node = self.comparative_expr()
+            operands[-1] = self.node(Nodes.OPERATOR, offset, lexeme,
+                                     (left, right))
+
+
+    def synchronize(self):
+        ## Skip the rest of a broken statement: up to and including a ';'
+        ## or a skipped block (with its else branches), or up to the '}'
+        ## closing the enclosing block. The start of a procedure or EOF
+        ## abandons the current procedure instead.
+        kinds = self.kinds
+        if (self.token_is(Tokens.LBRACE) and
+            kinds[self.pos - 1] == Tokens.IDENTIFIER.value):
+            self.pos -= 2
+            self.token()
+        depth = 0
         while True:
-            if self.accept(Tokens.AND):
-                if (node.node_type == Nodes.OPERATOR and
-                    node.lexeme == '|'):
-                    node.nodes[-1] = Node(Nodes.OPERATOR,
-                                          self.last_line, self.last_column, '&'
-                                          (node.nodes[-1],
-                                           self.comparative_expr()))
-                else:
-                    node = Node(Nodes.OPERATOR, self.last_line,
-                                self.last_column, '&',
-                                (node, self.comparative_expr()))
-            elif self.accept(Tokens.OR, Tokens.XOR):
-                node = Node(Nodes.OPERATOR,
-                            self.last_line,
-                            self.last_column,
-                            self.last_lexeme,
-                            (node, self.comparative_expr()))
-            else:
-                break
-        return node
+            if self.token_is(None) or self.at_procedure():
+                self.resync = True
+                return
+            elif self.token_is(Tokens.SEMICOLON) and not depth:
+                self.token()
+                return
+            elif self.token_is(Tokens.LBRACE):
+                depth += 1
+            elif self.token_is(Tokens.RBRACE):
+                if not depth:
+                    return
+                depth -= 1
+                if not depth:
+                    self.token()
+                    if not self.token_is(Tokens.ELSE):
+                        return
+                    continue
+            self.token()
 
 
-    def comparative_expr(self):
-        node = self.arithmetic_expr()
-        if self.accept(Tokens.EQUAL, Tokens.NOT_EQUAL,
-                       Tokens.GT, Tokens.GT_EQUAL,
-                       Tokens.LT, Tokens.LT_EQUAL):
-            node = Node(Nodes.OPERATOR,
-                        self.last_line,
-                        self.last_column,
-                        self.last_lexeme,
-                        (node, self.arithmetic_expr()))
-        return node
-
-    
-    def arithmetic_expr(self):
-        if self.accept(Tokens.PLUS):
-            node = self.term()
-        elif self.accept(Tokens.MINUS, Tokens.NOT):
-            node = Node(Nodes.OPERATOR,
-                        self.last_line,
-                        self.last_column,
-                        '~' if self.last_lexeme == '-' else '!',
-                        (self.term(),))
-        else:
-            node = self.term()
-        while self.accept(Tokens.PLUS, Tokens.MINUS):
-            node = Node(Nodes.OPERATOR,
-                        self.last_line,
-                        self.last_column,
-                        self.last_lexeme,
-                        (node, self.term(),))
-        return node
+    def at_procedure(self):
+        return (self.token_is(Tokens.IDENTIFIER) and
+                self.kinds[self.pos + 1] == Tokens.LBRACE.value)
 
 
-    def term(self):
-        node = self.factor()
-        while self.accept(Tokens.MULTIPLY, Tokens.DIVIDE,
-                          Tokens.MODULO):
-            node = Node(Nodes.OPERATOR,
-                        self.last_line,
-                        self.last_column,
-                        self.last_lexeme,
-                        (node, self.factor()))
-        return node
+    def node(self, node_type, offset=None, lexeme=None, nodes=()):
+        return Node(node_type, offset, lexeme, nodes, self.lines)
 
 
     def expect(self, *tokens):
         if not self.accept(*tokens):
-            raise ParseError(self._lexeme,
-                             self.tokenizer.line(),
-                             self.tokenizer.column(),
-                             None if len(tokens) > 1 else tokens[0])
+            raise self.error(None if len(tokens) > 1 else tokens[0])
         else:
             return self.last_lexeme
 
@@ -305,13 +416,15 @@ class Parser(object):
             return False
 
 
+    def error(self, expected=None):
+        line, column = self.lines.position(self.stream.offset(self.pos))
+        return ParseError(self.stream.lexeme(self.pos), line, column,
+                          expected)
+
+
     def token(self):
-        self.last_lexeme = self._lexeme
-        self.last_line = self.tokenizer.line()
-        self.last_column = self.tokenizer.column()
-        self._token, self._lexeme = self.tokenizer.token()
-        while self.token_is(Tokens.COMMENT):
-            self._token, self._lexeme = self.tokenizer.token()
+        self.pos += 1
+        self._token = self.kinds_of[self.kinds[self.pos]]
 
 
     def token_is(self, *tokens):
@@ -330,16 +443,17 @@ if __name__ == '__main__':
 
     try:
         with open(sys.argv[1], 'rt') as f:
-            parser = Parser(f.read())
+            parser = Parser(f.read(), recover=True)
     except:
         print(f'Usage: {sys.executable} {sys.argv[0]} <Source File>')
     else:
-        try:
-            root = parser.parse()
-            print_tree(root)
-            print()
+        root = parser.parse()
+        print_tree(root)
+        print()
+        for error in parser.errors:
+            print(error)
+        if not parser.errors:
             print('File successfully parsed.')
-        except ParseError:
-            import traceback
-            traceback.print_exc()
+        else:
+            sys.exit(1)
 
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+
+from opcodes import Opcodes
+
+
+class Peephole(object):
+    ## Works on linked code. Every word is one instruction, so a word is
+    ## only known to hold an address (rather than a number) through the
+    ## positions the generator recorded while emitting.
+    def __init__(self, code, addresses):
+        self.code = list(code)
+        self.addresses = set(addresses)
+
+
+    def optimize(self):
+        while self.thread() | self.prune():
+            pass
+        return self.code
+
+
+    def is_jump(self, pos, *opcodes):
+        ## A code address pushed right before the JMP or JIZ consuming it
+        return (pos in self.addresses and pos + 1 < len(self.code) and
+                self.code[pos + 1] in (opcodes or (Opcodes.JMP, Opcodes.JIZ)))
+
+
+    def thread(self):
+        ## Retarget jumps landing on an unconditional jump to its final
+        ## destination.
+        code = self.code
+        changed = False
+        for pos in self.addresses:
+            if not self.is_jump(pos):
+                continue
+            target = code[pos]
+            seen = {pos}
+            while (self.is_jump(target, Opcodes.JMP) and
+                   target not in seen):
+                seen.add(target)
+                target = code[target]
+            if target != code[pos]:
+                code[pos] = target
+                changed = True
+        return changed
+
+
+    def reachable(self):
+        ## Flow from the entry point. A bare JMP returns to one of the
+        ## pushed return addresses, which are followed as they are seen.
+        code = self.code
+        seen = set()
+        work = [0]
+        while work:
+            pos = work.pop()
+            while 0 <= pos < len(code) and pos not in seen:
+                seen.add(pos)
+                if self.is_jump(pos):
+                    seen.add(pos + 1)
+                    work.append(code[pos])
+                    if code[pos + 1] == Opcodes.JMP:
+                        break
+                    pos += 2
+                    continue
+                elif pos in self.addresses:
+                    work.append(code[pos])
+                elif code[pos] in (Opcodes.JMP, Opcodes.EOC):
+                    break
+                pos += 1
+        return seen
+
+
+    def prune(self):
+        code = self.code
+        live = self.reachable()
+        targets = {code[pos] for pos in self.addresses if pos in live}
+        dead = {pos for pos in range(len(code))
+                if pos not in live and code[pos] != Opcodes.EOC}
+        for pos in sorted(self.addresses):
+            if pos not in live or not self.is_jump(pos, Opcodes.JMP):
+                continue
+            target = code[pos]
+            if target == pos + 2 and pos + 1 not in targets:
+                ## A jump to the next instruction
+                dead.update((pos, pos + 1))
+            elif (0 <= target < len(code) and code[target] == Opcodes.JMP and
+                  target not in self.addresses):
+                ## Jumping to a return is returning: keep just the JMP.
+                dead.add(pos)
+        if not dead:
+            return False
+        self.remove(dead)
+        return True
+
+
+    def remove(self, dead):
+        code = self.code
+        ## Where each old position ends up; a removed word maps to the
+        ## next word that stays.
+        moved = [0] * (len(code) + 1)
+        size = 0
+        for pos in range(len(code)):
+            moved[pos] = size
+            if pos not in dead:
+                size += 1
+        moved[len(code)] = size
+
+        new_code = []
+        new_addresses = set()
+        for pos, word in enumerate(code):
+            if pos in dead:
+                continue
+            if pos in self.addresses:
+                new_addresses.add(len(new_code))
+                if 0 <= word <= len(code):
+                    word = moved[word]
+            new_code.append(word)
+        self.code = new_code
+        self.addresses = new_addresses
+
+
+def jumps(code):
+    return sum(1 for word in code if word in (Opcodes.JMP, Opcodes.JIZ))
+
+
+if __name__ == '__main__':
+    import argparse
+    import os
+    import sys
+
+    from code import CodeError, CodeGenerator
+    from parser import ParseError, Parser
+    from utils import BOT_HEADER, bot_source
+
+    parser = argparse.ArgumentParser(
+        description='Report bytecode size before and after peephole '
+                    'optimization')
+    parser.add_argument('files', nargs='+', metavar='FILE',
+                        help='Source or .bot files')
+    args = parser.parse_args()
+
+    print(f'{"Bot":<24} {"Words":>6} {"After":>6} {"Saved":>6} '
+          f'{"Jumps":>6} {"After":>6}')
+    total = [0, 0]
+    for path in args.files:
+        with open(path, 'rb') as f:
+            data = f.read()
+        source = (bot_source(data) if data.startswith(BOT_HEADER)
+                  else str(data, 'ascii'))
+        name = os.path.basename(path)
+        try:
+            codegen = CodeGenerator(Parser(source).parse())
+            code = codegen.generate()
+        except (ParseError, CodeError) as e:
+            print(f'{name:<24} {e}', file=sys.stderr)
+            continue
+        peephole = Peephole(code, codegen.linker.addresses)
+        optimized = peephole.optimize()
+        total[0] += len(code)
+        total[1] += len(optimized)
+        print(f'{name:<24} {len(code):>6} {len(optimized):>6} '
+              f'{len(code) - len(optimized):>6} '
+              f'{jumps(code):>6} '
+              f'{jumps(optimized):>6}')
+    if total[0]:
+        print(f'{"Total":<24} {total[0]:>6} {total[1]:>6} '
+              f'{total[0] - total[1]:>6} '
+              f'({(total[0] - total[1]) / total[0]:.1%})')
@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+
+import errno
+import json
+import os
+import socket
+import socketserver
+import struct
+import tempfile
+import threading
+from collections import OrderedDict
+
+from cache import Cache
+from code import CodeError
+from compiler import COMPILER_VERSION, Compiler
+from parser import ParseError
+from utils import prettify_code
+from validator import validate
+from versions import Versions
+
+
+DEFAULT_SOCKET = os.path.join(tempfile.gettempdir(),
+                              f'warbots-{os.getuid()}.sock')
+
+## Each message is a JSON object preceded by its length.
+HEADER = struct.Struct('>I')
+MAX_MESSAGE = 16 * 1024 * 1024
+
+
+class ProtocolError(Exception): pass
+
+
+def send_message(sock, message):
+    data = json.dumps(message, separators=(',', ':')).encode('utf-8')
+    sock.sendall(HEADER.pack(len(data)) + data)
+
+
+def receive_message(sock):
+    ## The next message, or None once the peer is done
+    header = receive_exactly(sock, HEADER.size)
+    if header is None:
+        return None
+    size, = HEADER.unpack(header)
+    if size > MAX_MESSAGE:
+        raise ProtocolError(f'Message of {size} bytes is too large')
+    data = receive_exactly(sock, size)
+    if data is None:
+        raise ProtocolError('Connection closed inside a message')
+    return json.loads(data)
+
+
+def receive_exactly(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 65536))
+        if not chunk:
+            if chunks:
+                raise ProtocolError('Connection closed inside a message')
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def request(message, path=DEFAULT_SOCKET):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(path)
+        send_message(sock, message)
+        return receive_message(sock)
+
+
+def error_message(error):
+    message = {'ok': False, 'error': str(error),
+               'type': type(error).__name__}
+    if isinstance(error, ParseError):
+        message['line'] = error.line
+        message['column'] = error.column
+    return message
+
+
+class Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        ## Any number of requests per connection, answered in order
+        while True:
+            try:
+                message = receive_message(self.request)
+            except (ProtocolError, ValueError) as e:
+                send_message(self.request, error_message(e))
+                return
+            except OSError:
+                return
+            if message is None:
+                return
+            reply = self.server.dispatch(message)
+            if isinstance(message, dict) and 'id' in message:
+                reply['id'] = message['id']
+            try:
+                send_message(self.request, reply)
+            except OSError:
+                return
+
+
+class CompileServer(socketserver.ThreadingMixIn,
+                    socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    ## Compiled code kept in memory, most recently used last
+    MEMO_SIZE = 512
+    ## Incremental compilers kept for clients naming the file they send
+    COMPILERS = 64
+
+    def __init__(self, path=DEFAULT_SOCKET, cache=None):
+        ## A socket left behind by a server that is gone is replaced;
+        ## one a server still answers on is not.
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+            try:
+                probe.connect(path)
+            except FileNotFoundError:
+                pass
+            except ConnectionRefusedError:
+                os.unlink(path)
+            else:
+                raise OSError(errno.EADDRINUSE,
+                              f'A server is already listening on {path}')
+        super().__init__(path, Handler)
+        self.cache = cache
+        self.lock = threading.Lock()
+        self.memo = OrderedDict()
+        self.compilers = OrderedDict()
+        self.requests = 0
+        self.hits = 0
+
+
+    def server_close(self):
+        super().server_close()
+        try:
+            os.unlink(self.server_address)
+        except OSError:
+            pass
+
+
+    def dispatch(self, message):
+        if not isinstance(message, dict):
+            return error_message(ProtocolError('Expected a JSON object'))
+        with self.lock:
+            self.requests += 1
+        handler = {
+            'compile': self.compile,
+            'disassemble': self.disassemble,
+            'validate': self.validate,
+            'stats': self.stats,
+        }.get(message.get('op'))
+        if handler is None:
+            return error_message(
+                ProtocolError(f'Unknown op {message.get("op")!r}'))
+        try:
+            return handler(message)
+        except (CodeError, ParseError, ProtocolError) as e:
+            return error_message(e)
+        except (KeyError, TypeError, ValueError) as e:
+            return error_message(ProtocolError(f'Bad request: {e!r}'))
+        except Exception as e:
+            ## Whatever else fails is still this request's answer; the
+            ## connection stays usable for the next one.
+            return error_message(e)
+
+
+    def compile(self, message):
+        code = self.generate(message)
+        return {'ok': True, 'words': len(code), 'code': code}
+
+
+    def disassemble(self, message):
+        code = message.get('code')
+        if code is None:
+            code = self.generate(message)
+        return {'ok': True, 'listing': prettify_code(code)}
+
+
+    def validate(self, message):
+        errors = validate(message['source'], recover=message.get('all'))
+        return {'ok': not errors,
+                'errors': [error_message(error) for error in errors]}
+
+
+    def stats(self, message):
+        with self.lock:
+            return {'ok': True, 'requests': self.requests,
+                    'hits': self.hits, 'memo': len(self.memo),
+                    'compilers': len(self.compilers)}
+
+
+    def generate(self, message):
+        source = message['source']
+        version = Versions[message.get('target', 'V2_0_0')]
+        optimize = bool(message.get('optimize'))
+        speed = bool(message.get('speed'))
+        key = Cache.key(source, version.value, optimize, speed,
+                        COMPILER_VERSION)
+        with self.lock:
+            entry = self.memo.get(key)
+            if entry is not None:
+                self.memo.move_to_end(key)
+                self.hits += 1
+        if entry is None:
+            entry = self.build(message.get('path'), source, version,
+                               optimize, speed)
+            with self.lock:
+                self.memo[key] = entry
+                if len(self.memo) > self.MEMO_SIZE:
+                    self.memo.popitem(last=False)
+        code, error = entry
+        if error is not None:
+            raise error
+        return code
+
+
+    def build(self, path, source, version, optimize, speed):
+        ## A client naming its file gets a compiler of its own that
+        ## reparses only the procedures changed since its last request.
+        options = (optimize, speed)
+        if path is None:
+            compiler = Compiler(source, optimize=optimize, speed=speed,
+                                cache=self.cache)
+            lock = threading.Lock()
+        else:
+            with self.lock:
+                entry = self.compilers.get(path)
+                if entry is None or entry[0] != options:
+                    entry = (options,
+                             Compiler(source, incremental=True,
+                                      optimize=optimize, speed=speed,
+                                      cache=self.cache),
+                             threading.Lock())
+                    self.compilers[path] = entry
+                    if len(self.compilers) > self.COMPILERS:
+                        self.compilers.popitem(last=False)
+                self.compilers.move_to_end(path)
+            _, compiler, lock = entry
+        with lock:
+            if compiler.source != source:
+                compiler.update(source)
+            try:
+                code = compiler.compile(version)
+            except (CodeError, ParseError) as e:
+                return None, e
+        return [int(word) for word in code], None
+
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(
+        description='Serve compile, validate and disassemble requests on a '
+                    'Unix socket')
+    parser.add_argument('--socket', default=DEFAULT_SOCKET)
+    parser.add_argument('--cache', metavar='DIR', nargs='?', const=True,
+                        help='Also use the on-disk compiled code cache')
+    args = parser.parse_args()
+
+    cache = args.cache
+    if cache is True:
+        cache = Cache()
+    elif cache is not None:
+        cache = Cache(cache)
+    try:
+        server = CompileServer(args.socket, cache)
+    except OSError as e:
+        sys.exit(f'{args.socket}: {e.strerror}')
+    with server:
+        print(f'Serving on {args.socket}')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
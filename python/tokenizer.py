@@ -1,5 +1,11 @@
 # -*- coding: utf-8 -*-
 
+import mmap
+import re
+import sys
+
+from array import array
+from bisect import bisect_right
 from enum import Enum, auto
 
 
@@ -37,20 +43,44 @@ class Tokens(Enum):
     XOR = auto()
 
 
-class States(Enum):
-    START = auto()
-    IN_BANG = auto()
-    IN_COMMENT = auto()
-    IN_EQUAL = auto()
-    IN_GT = auto()
-    IN_IDENT = auto()
-    IN_INT = auto()
-    IN_LINE_COMMENT = auto()
-    IN_LT = auto()
-    IN_SLASH = auto()
+CHUNK_SIZE = 1 << 16
 
+BUFFERS = (bytes, bytearray, memoryview, mmap.mmap)
 
-class Tokenizer(object):
+
+## Bot sources are ASCII, so they may be lexed straight out of bytes,
+## bytearrays, memoryviews or mmaps as well as from str. Line ends are
+## '\n', '\r\n' or a lone '\r'; none of them is rewritten, offsets always
+## index the buffer as given.
+def is_text(source):
+    return isinstance(source, str)
+
+
+class LineIndex(object):
+    newline = re.compile(r'\r\n?|\n')
+    bytes_newline = re.compile(br'\r\n?|\n')
+
+    def __init__(self, source, start=0, end=None):
+        self.update(source, start, end)
+
+    def update(self, source, start=0, end=None):
+        self.source = source
+        self.start = start
+        self.end = len(source) if end is None else end
+        self.starts = None
+
+    def position(self, offset):
+        if self.starts is None:
+            newline = (self.newline if is_text(self.source)
+                       else self.bytes_newline)
+            self.starts = array('l', [self.start])
+            self.starts.extend(m.end() for m in newline.finditer(
+                self.source, self.start, self.end))
+        line = bisect_right(self.starts, offset)
+        return line, offset - self.starts[line - 1] + 1
+
+
+class TokenStream(object):
     reserved = {
         ',': Tokens.COMMA,
         '{': Tokens.LBRACE,
@@ -61,162 +91,216 @@ class Tokenizer(object):
         '-': Tokens.MINUS,
         '*': Tokens.MULTIPLY,
         '/': Tokens.DIVIDE,
+        '%': Tokens.MODULO,
         '!': Tokens.NOT,
         '&': Tokens.AND,
         '|': Tokens.OR,
         '^': Tokens.XOR,
         ';': Tokens.SEMICOLON,
+        '=': Tokens.ASSIGN,
+        '==': Tokens.EQUAL,
+        '!=': Tokens.NOT_EQUAL,
+        '>': Tokens.GT,
+        '>=': Tokens.GT_EQUAL,
+        '<': Tokens.LT,
+        '<=': Tokens.LT_EQUAL,
         'else': Tokens.ELSE,
         'if': Tokens.IF,
         'return': Tokens.RETURN,
         'while': Tokens.WHILE,
     }
 
-    def __init__(self, source):
-        self.ptr = 0
-        self._line = 1
-        self._column = 0
-        self.start_line = None
-        self.start_column = None
-        self.source = source.replace('\r\n', '\n').replace('\r', '\n')
-        self.state = States.START
+    ## Leading blanks are folded into each match and the number of the
+    ## group that matched selects the token class, so the whole source is
+    ## lexed by a single scan.
+    pattern_text = r"""
+        [ \t\n\r\x0b\x0c\x1c-\x1f]*
+        (?:
+            (//[^\r\n]*|/\*.*?(?:\*/|\Z))   # 1: comment
+          | ([^\W\d]\w*)                    # 2: word
+          | ([0-9]+)                         # 3: integer
+          | ([=!<>]=?|[-,{}()+*/%&|^;])      # 4: operator
+          | ([^ \t\n\r\x0b\x0c\x1c-\x1f])     # 5: unknown
+        )
+    """
+    pattern = re.compile(pattern_text, re.VERBOSE | re.DOTALL)
+    bytes_pattern = re.compile(pattern_text.encode('ascii'),
+                               re.VERBOSE | re.DOTALL)
+
+    codes = {lexeme: token.value for lexeme, token in reserved.items()}
+    bytes_codes = {lexeme.encode('ascii'): code
+                   for lexeme, code in codes.items()}
+
+    variables = frozenset('abcdefghijklmnopqrstuvwxyz')
+    bytes_variables = frozenset(v.encode('ascii') for v in variables)
+
+    ## Token kinds are stored as their enum value; 0 marks the end.
+    kinds_of = (None,) + tuple(Tokens)
+
+    interned = frozenset((Tokens.IDENTIFIER.value, Tokens.VAR.value))
+
+    def __init__(self, source, comments=False, start=0, end=None):
+        self.source = source
+        self.start = start
+        self.end = len(source) if end is None else end
+        self.lines = LineIndex(source, start, self.end)
+        self.kinds = array('B')
+        self.starts = array('l')
+        self.ends = array('l')
+        kinds = self.kinds.append
+        starts = self.starts.append
+        ends = self.ends.append
+        for kind, first, last in self.scan(source, comments,
+                                           start, self.end):
+            kinds(kind)
+            starts(first)
+            ends(last)
+        kinds(0)
+        starts(self.end)
+        ends(self.end)
+
+    @classmethod
+    def scan(cls, source, comments=False, start=0, end=None):
+        if is_text(source):
+            pattern, codes, variables = (cls.pattern, cls.codes,
+                                         cls.variables)
+        else:
+            pattern, codes, variables = (cls.bytes_pattern, cls.bytes_codes,
+                                         cls.bytes_variables)
+        VAR = Tokens.VAR.value
+        IDENTIFIER = Tokens.IDENTIFIER.value
+        INTEGER = Tokens.INTEGER.value
+        COMMENT = Tokens.COMMENT.value
+        UNKNOWN = Tokens.UNKNOWN.value
+        for m in pattern.finditer(source, start,
+                                  len(source) if end is None else end):
+            group = m.lastindex
+            if group == 2:
+                lower = m.group(2).lower()
+                if lower in codes:
+                    kind = codes[lower]
+                elif lower in variables:
+                    kind = VAR
+                else:
+                    kind = IDENTIFIER
+            elif group == 4:
+                kind = codes[m.group(4)]
+            elif group == 3:
+                kind = INTEGER
+            elif group == 1:
+                if not comments:
+                    continue
+                kind = COMMENT
+            else:
+                kind = UNKNOWN
+            yield kind, m.start(group), m.end()
+
+    def __len__(self):
+        return len(self.kinds) - 1
+
+    def kind(self, i):
+        return self.kinds_of[self.kinds[i]]
+
+    def lexeme(self, i):
+        kind = self.kinds[i]
+        if kind:
+            lexeme = self.source[self.starts[i]:self.ends[i]]
+            if not is_text(lexeme):
+                lexeme = str(lexeme, 'ascii')
+            if kind in self.interned:
+                return sys.intern(lexeme)
+            return lexeme
+
+    def offset(self, i):
+        return self.starts[i]
+
+    def position(self, i):
+        return self.lines.position(self.starts[i])
+
+
+class Tokenizer(object):
+    def __init__(self, source, start=0, end=None):
+        self.stream = TokenStream(source, True, start, end)
+        self.source = self.stream.source
+        self.lines = self.stream.lines
+        self.reset()
 
     def reset(self):
         self.ptr = 0
-        self._line = 1
-        self._column = 0
-        self.start_line = None
-        self.start_column = None
-        self.state = States.START
+        self.start = None
 
     def token(self):
-        lastc = None
-        lexeme = ''
-        state = States.START
-        self.start_line = None
-        self.start_column = None
-        while True:
-            c = self.get()
-            if state == States.START:
-                self.start_line = self._line
-                self.start_column = self._column
-                if c is None:
-                    return None, None
-                elif c.isspace():
-                    continue
-                elif c == '!':
-                    state = States.IN_BANG
-                elif c.isidentifier():
-                    state = States.IN_IDENT
-                elif c.isdigit():
-                    state = States.IN_INT
-                elif c == '/':
-                    state = States.IN_SLASH
-                elif c == '>':
-                    state = States.IN_GT
-                elif c == '<':
-                    state = States.IN_LT
-                elif c == '=':
-                    state = States.IN_EQUAL
-                elif c in self.reserved:
-                    return self.reserved[c], c
-                else:
-                    return Tokens.UNKNOWN, c
-            elif state == States.IN_BANG:
-                if c == '=':
-                    return Tokens.NOT_EQUAL
-                else:
-                    self.unget()
-                    return Tokens.NOT, lexeme
-            elif state == States.IN_COMMENT:
-                if c == '/':
-                    if lastc == '*':
-                        return Tokens.COMMENT, lexeme
-            elif state == States.IN_EQUAL:
-                if c == '=':
-                    return Tokens.EQUAL, lexeme + c
-                else:
-                    self.unget()
-                    return Tokens.ASSIGN, lexeme
-            elif state == States.IN_GT:
-                if c == '=':
-                    return Tokens.GT_EQUAL, lexeme + c
-                else:
-                    self.unget()
-                    return Tokens.GT, lexeme
-            elif state == States.IN_IDENT:
-                if (c is not None and not c.isdigit() and
-                    not c.isidentifier()):
-                    self.unget()
-                    try:
-                        return self.reserved[lexeme.lower()], lexeme
-                    except:
-                        if lexeme.lower() in list(
-                                'abcdefghijklmnopqrstuvwxyz'):
-                            return Tokens.VAR, lexeme
-                        else:
-                            return Tokens.IDENTIFIER, lexeme
-            elif state == States.IN_INT:
-                if c is not None and not c.isdigit():
-                    self.unget()
-                    return Tokens.INTEGER, lexeme
-            elif state == States.IN_LINE_COMMENT:
-                if c in ('\n', None):
-                    return Tokens.COMMENT, lexeme
-            elif state == States.IN_LT:
-                if c == '=':
-                    return Tokens.LT_EQUAL, lexeme + c
-                else:
-                    self.unget()
-                    return Tokens.LT, lexeme
-            elif state == States.IN_SLASH:
-                if c == '/':
-                    state = States.IN_LINE_COMMENT
-                elif c == '*':
-                    state = States.IN_COMMENT
-                else:
-                    self.unget()
-                    return Tokens.DIVIDE, lexeme
-
-            lexeme += c
-            lastc = c
-            
-    def get(self):
-        try:
-            advance_line = self.ptr > 1 and self.source[self.ptr - 1] == '\n'
-            c = self.source[self.ptr]
+        token = self.stream.kind(self.ptr)
+        lexeme = self.stream.lexeme(self.ptr)
+        self.start = self.stream.offset(self.ptr)
+        if token is not None:
             self.ptr += 1
-            self._column += 1
-            if advance_line:
-                self._line += 1
-                self._column = 1
-            return c
-        except:
-            return None
-
-    def unget(self):
-        if self.ptr < len(self.source) and self.ptr > 0:
-            self.ptr -= 1
-            self._column -= 1
-            if self.source[self.ptr] == '\n' and self._line > 1:
-                self._line -= 1
-                newline_pos = self.source.rfind('\n', 0, self.ptr)
-                self._column = self.ptr - max(newline_pos, 0)
+        return token, lexeme
+
+    def offset(self):
+        return self.start
 
     def line(self):
-        return self.start_line
+        if self.start is not None:
+            return self.lines.position(self.start)[0]
 
     def column(self):
-        return self.start_column
+        if self.start is not None:
+            return self.lines.position(self.start)[1]
+
+
+def tokenize(source, comments=False, start=0, end=None,
+             chunk_size=CHUNK_SIZE):
+    if is_text(source) or isinstance(source, BUFFERS):
+        return tokenize_buffer(source, comments, start, end)
+    else:
+        return tokenize_file(source, comments, chunk_size)
+
+
+def tokenize_buffer(source, comments=False, start=0, end=None):
+    kinds_of = TokenStream.kinds_of
+    text = is_text(source)
+    for kind, first, last in TokenStream.scan(source, comments, start, end):
+        lexeme = source[first:last]
+        yield (kinds_of[kind], lexeme if text else str(lexeme, 'ascii'),
+               first)
+
 
+def tokenize_file(f, comments=False, chunk_size=CHUNK_SIZE):
+    ## A token that runs into the end of a chunk may continue in the
+    ## next one, so it is carried over and lexed again with more input.
+    kinds_of = TokenStream.kinds_of
+    base = 0
+    carry = b''
+    while True:
+        chunk = f.read(chunk_size)
+        if isinstance(chunk, str):
+            chunk = chunk.encode('ascii')
+        buff = carry + chunk if carry else chunk
+        carry = b''
+        for kind, first, last in TokenStream.scan(buff, comments):
+            if chunk and last == len(buff):
+                carry = buff[first:]
+                base += first
+                break
+            yield (kinds_of[kind], str(buff[first:last], 'ascii'),
+                   base + first)
+        else:
+            if not chunk:
+                return
+            base += len(buff)
 
 
 if __name__ == '__main__':
     import sys
+    from utils import BOT_HEADER, bot_source_span
     try:
-        with open(sys.argv[1], 'rt') as f:
-            scode = f.read()
-            t = Tokenizer(scode)
+        with open(sys.argv[1], 'rb') as f:
+            buff = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            start, end = (bot_source_span(buff)
+                          if buff[:len(BOT_HEADER)] == BOT_HEADER
+                          else (0, len(buff)))
+            t = Tokenizer(buff, start, end)
             while True:
                 token, lexeme = t.token()
                 if token is None:
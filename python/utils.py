@@ -5,6 +5,8 @@ import struct
 from opcodes import Opcodes
 
 
+BOT_HEADER = b'WBMD2.0\x00'
+
 OFFS_HEADER = 0    #Size: 8
 OFFS_NAME = 8      #Size: 20
 
@@ -78,3 +80,17 @@ def prettify_code(b):
     
     return '\n'.join([inst(i, c) for i, c in enumerate(b)])
 
+
+
+def bot_source_span(b):
+    size, = struct.unpack_from('<H', b, OFFS_BYTECODE_SIZE)
+    start = OFFS_CODE_START + size*SHORT_SIZE
+    end = len(b)
+    while end > start and b[end - 1] == 0:
+        end -= 1
+    return start, end
+
+
+def bot_source(b):
+    start, end = bot_source_span(b)
+    return str(b[start:end], 'ascii')
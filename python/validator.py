@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+import mmap
+import sys
+
+from parser import Node, ParseError, Parser
+from utils import BOT_HEADER, bot_source_span
+
+
+class NullNode(Node):
+    __slots__ = ()
+
+    def add_nodes(self, *nodes):
+        return self
+
+
+## Stands in for every node while validating, so the grammar in Parser
+## runs unchanged without building a tree.
+NULL = NullNode(None)
+
+
+def nothing(*args):
+    pass
+
+
+class Validator(Parser):
+    def __init__(self, source, start=0, end=None, recover=False):
+        super().__init__(source, start, end, recover)
+        self.lexeme = nothing
+
+
+    def node(self, node_type, offset=None, lexeme=None, nodes=()):
+        return NULL
+
+
+def validate(source, start=0, end=None, recover=False):
+    validator = Validator(source, start, end, recover)
+    try:
+        validator.parse()
+    except ParseError as e:
+        return [e]
+    return validator.errors
+
+
+def validate_file(path, recover=False):
+    with open(path, 'rb') as f:
+        if not f.seek(0, 2):
+            return []
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            start, end = 0, None
+            if m[:len(BOT_HEADER)] == BOT_HEADER:
+                start, end = bot_source_span(m)
+            return validate(m, start, end, recover)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Check the syntax of source or .bot files')
+    parser.add_argument('files', nargs='+', metavar='FILE')
+    parser.add_argument('-a', '--all', action='store_true',
+                        help='Report every error, not just the first')
+    parser.add_argument('-q', '--quiet', action='store_true',
+                        help='Only report files with errors')
+    args = parser.parse_args()
+    failed = 0
+    for path in args.files:
+        errors = validate_file(path, args.all)
+        if errors:
+            failed += 1
+            for error in errors:
+                print(f'{path}: {error}')
+        elif not args.quiet:
+            print(f'{path}: OK')
+    sys.exit(1 if failed else 0)
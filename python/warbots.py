@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+
+import sys
+
+
+## The one entry point for the tools, run as python warbots.py; the
+## project is not packaged, so there is no console script to install.
+## Every subsystem is imported by the command using it, so a quick look
+## at a file pays only for what that look needs. bench.py startup keeps
+## an eye on what each command costs before doing any work.
+
+
+def read_file(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def source_of(data):
+    from utils import BOT_HEADER, bot_source
+    return (bot_source(data) if data.startswith(BOT_HEADER)
+            else str(data, 'ascii'))
+
+
+def command_inspect(argv):
+    import argparse
+
+    import attribs
+    from botfile import BotFile, BotFileError
+
+    parser = argparse.ArgumentParser(prog='warbots inspect',
+                                     description='Show the header of a .bot '
+                                                 'file')
+    parser.add_argument('file', metavar='FILE')
+    parser.add_argument('-s', '--source', action='store_true',
+                        help='Print the source code too')
+    args = parser.parse_args(argv)
+
+    try:
+        bot = BotFile(read_file(args.file))
+    except BotFileError as e:
+        return f'{args.file}: {e}'
+
+    def attrib(value, names):
+        return names.get(value, f'unknown ({value})')
+
+    print('Name:', bot.name)
+    print('Energy:', attrib(bot.energy, attribs.LEVEL_NAMES))
+    print('Shield:', attrib(bot.shield, attribs.LEVEL_NAMES))
+    print('Armor:', attrib(bot.armor, attribs.STRENGTH_NAMES))
+    print('CPU Speed:', attrib(bot.speed, attribs.CPC_VALUES), 'cpc')
+    print('Bullet:', attrib(bot.bullet, attribs.BULLET_NAMES))
+    print('Missiles:', 'Yes' if bot.missiles else 'No')
+    print('Tactical Nukes:', 'Yes' if bot.tactical_nukes else 'No')
+    print('Compiled code:',
+          f'{bot.code_size} words' if bot.compiled else 'N/A')
+    print('Source code:', f'{bot.source.nbytes} bytes')
+    if args.source:
+        print()
+        print(bot.text)
+
+
+def command_compile(argv):
+    from compiler import main
+    return main(argv)
+
+
+def command_catalog(argv):
+    from catalog import main
+    return main(argv)
+
+
+def command_disasm(argv):
+    import argparse
+
+    from utils import BOT_HEADER
+
+    parser = argparse.ArgumentParser(prog='warbots disasm',
+                                     description='List the code of a .bot '
+                                                 'file, compiling its source '
+                                                 'if it holds no code')
+    parser.add_argument('file', metavar='FILE')
+    parser.add_argument('-c', '--compile', action='store_true',
+                        help='Compile the source even if code is stored')
+    parser.add_argument('-O', '--optimize', action='store_true')
+    parser.add_argument('--target', default='V2_0_0')
+    args = parser.parse_args(argv)
+
+    data = read_file(args.file)
+    if (data.startswith(BOT_HEADER) and not args.compile and
+        not args.optimize):
+        from botfile import BotFile
+        from utils import prettify_code
+        bot = BotFile(data)
+        if bot.compiled:
+            print(prettify_code(bot.code))
+            return
+
+    from code import CodeError
+    from compiler import Compiler
+    from parser import ParseError
+    from utils import prettify_code
+    from versions import Versions
+
+    if args.target not in Versions.__members__:
+        parser.error(f'unknown target {args.target}')
+    compiler = Compiler(source_of(data), optimize=args.optimize)
+    try:
+        code = compiler.compile(Versions[args.target])
+    except (CodeError, ParseError) as e:
+        return f'{args.file}: {e}'
+    print(prettify_code(code))
+
+
+def command_tokens(argv):
+    import argparse
+
+    from tokenizer import Tokenizer
+
+    parser = argparse.ArgumentParser(prog='warbots tokens',
+                                     description='List the tokens of a '
+                                                 'source or .bot file')
+    parser.add_argument('file', metavar='FILE')
+    args = parser.parse_args(argv)
+
+    source = source_of(read_file(args.file))
+    t = Tokenizer(source, 0, len(source))
+    while True:
+        token, lexeme = t.token()
+        if token is None:
+            break
+        print(token.name, lexeme, f'{t.column()}, {t.line()}')
+
+
+def command_tree(argv):
+    import argparse
+
+    from parser import Parser
+
+    parser = argparse.ArgumentParser(prog='warbots tree',
+                                     description='Print the syntax tree of a '
+                                                 'source or .bot file')
+    parser.add_argument('file', metavar='FILE')
+    args = parser.parse_args(argv)
+
+    syntax = Parser(source_of(read_file(args.file)), recover=True)
+    stack = [(syntax.parse(), 0)]
+    while stack:
+        node, depth = stack.pop()
+        print(f'{".  " * depth}{node}')
+        stack.extend((child, depth + 1) for child in reversed(node.nodes))
+    print()
+    for error in syntax.errors:
+        print(error)
+    if not syntax.errors:
+        print('File successfully parsed.')
+    return 1 if syntax.errors else 0
+
+
+COMMANDS = {
+    'inspect': (command_inspect, 'Show the header of a .bot file'),
+    'compile': (command_compile, 'Compile files, one or in batch'),
+    'disasm': (command_disasm, 'List the code of a file'),
+    'catalog': (command_catalog, 'Index .bot files and query the index'),
+    'tokens': (command_tokens, 'List the tokens of a file'),
+    'tree': (command_tree, 'Print the syntax tree of a file'),
+}
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog='warbots',
+        description='Inspect, compile and take apart WarBots programs',
+        epilog='Commands: ' + '; '.join(
+            f'{name}: {help}' for name, (_, help) in COMMANDS.items()))
+    parser.add_argument('command', choices=list(COMMANDS))
+    parser.add_argument('args', nargs=argparse.REMAINDER,
+                        help='Arguments of the command; see '
+                             'warbots COMMAND -h')
+    args = parser.parse_args(argv)
+    return COMMANDS[args.command][0](args.args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())